@@ -2,39 +2,50 @@ from flask import Blueprint
 from models import Actor
 from flask import request, abort, jsonify
 from auth import requires_auth
+from generations import conditional
+from listing import page, detail, export
+from writes import insert_record, update_record, delete_record, supplied
+from bulk import create_batch
 
 actors_blueprint = Blueprint('actors_blueprint', __name__)
 
 
 @actors_blueprint.route('/actors', methods=['GET'])
 @requires_auth(permission='get:actors')
+@conditional(Actor)
 def get_actors():
-    actors = Actor.query.all()
-    format_actors = [actor.format() for actor in actors]
+    format_actors, next_cursor = page(Actor)
     return jsonify({
         "success": True,
-        "actors": format_actors
+        "actors": format_actors,
+        "next": next_cursor
     })
 
 
+@actors_blueprint.route('/actors/export', methods=['GET'])
+@requires_auth(permission='get:actors')
+@conditional(Actor)
+def export_actors():
+    return export(Actor)
+
+
 @actors_blueprint.route('/actors/<int:actor_id>', methods=['GET'])
 @requires_auth(permission='get:actors')
+@conditional(Actor)
 def get_actor(actor_id):
-    actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
-    if actor is None:
+    format_actor = detail(Actor, actor_id)
+    if format_actor is None:
         abort(404)
     else:
-        format_actors = [actor.format()]
         return jsonify({
             "success": True,
-            "actors": format_actors
+            "actors": [format_actor]
         })
 
 
 @actors_blueprint.route('/actors', methods=['POST'])
 @requires_auth(permission='post:actors')
 def create_actor():
-    success = False
     body = request.get_json()
     if body is None:
         abort(400)
@@ -46,91 +57,51 @@ def create_actor():
         if check:
             abort(400)
         else:
-            actor = Actor(name=name, dob=dob, gender_id=gender_id)
-            try:
-                actor.insert()
-                actor.apply()
-                actor.refresh()
-                format_actors = [actor.format()]
-                success = True
-            finally:
-                if success:
-                    actor.dispose()
-                    return jsonify({
-                        "success": success,
-                        'created': actor.id,
-                        'actors': format_actors
-                    })
-                else:
-                    actor.rollback()
-                    actor.dispose()
-                    abort(422)
+            format_actor = insert_record(Actor, {
+                "name": name, "dob": dob, "gender_id": gender_id})
+            return jsonify({
+                "success": True,
+                "created": format_actor["id"],
+                "actors": [format_actor]
+            })
+
+
+@actors_blueprint.route('/actors/batch', methods=['POST'])
+@requires_auth(permission='post:actors')
+def create_actors():
+    return create_batch(Actor)
 
 
 @actors_blueprint.route('/actors/<int:actor_id>', methods=['PATCH'])
 @requires_auth(permission='patch:actors')
 def modify_actor(actor_id):
-    success = False
     body = request.get_json()
     if body is None:
         abort(400)
     else:
-        name = body.get('name', None)
-        dob = body.get('dob', None)
-        gender_id = body.get('gender_id', None)
-        check = name is None or dob is None or gender_id is None
-        if check:
+        values = supplied(body, ["name", "dob", "gender_id"])
+        if len(values) == 0:
             abort(400)
         else:
-            actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
-            if actor is None:
+            format_actor = update_record(Actor, actor_id, values)
+            if format_actor is None:
                 abort(422)
             else:
-                try:
-                    actor.name = name
-                    actor.dob = dob
-                    actor.gender_id = gender_id
-                    actor.apply()
-                    format_actors = [actor.format()]
-                    success = True
-                finally:
-                    if success:
-                        actor.dispose()
-                        return jsonify({
-                            "success": success,
-                            "modified": actor_id,
-                            "actors": format_actors
-                        })
-                    else:
-                        actor.rollback()
-                        actor.dispose()
-                        abort(422)
+                return jsonify({
+                    "success": True,
+                    "modified": actor_id,
+                    "actors": [format_actor]
+                })
 
 
 @actors_blueprint.route('/actors/<int:actor_id>', methods=['DELETE'])
 @requires_auth(permission='delete:actors')
 def delete_actor(actor_id):
-    success = False
-    if actor_id is None:
-        abort(400)
+    if delete_record(Actor, actor_id) is None:
+        abort(422)
     else:
-        actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
-        if actor is None:
-            abort(422)
-        else:
-            try:
-                actor.delete()
-                actor.apply()
-                success = True
-            finally:
-                if success:
-                    actor.dispose()
-                    return jsonify({
-                        "success": success,
-                        "deleted": actor_id,
-                        "actors": []
-                    })
-                else:
-                    actor.rollback()
-                    actor.dispose()
-                    abort(422)
+        return jsonify({
+            "success": True,
+            "deleted": actor_id,
+            "actors": []
+        })
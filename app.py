@@ -1,18 +1,18 @@
 from auth import AuthError
 from flask import Flask, jsonify
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate, migrate
 from flask_cors import CORS
 from actors_blueprint import actors_blueprint
 from castings_blueprint import castings_blueprint
 from genders_blueprint import genders_blueprint
 from movies_blueprint import movies_blueprint
-from models import get_migrate, setup_db, get_db
+from metrics_blueprint import metrics_blueprint
+from models import setup_db, load_lookups
+from importer import import_csv_command
+import unit_of_work
+import notifications
 import os
 
-db = SQLAlchemy()
-migrate = Migrate()
-test_mode = os.getenv('TEST_MODE')
+test_mode = os.getenv('TEST_MODE', '0') == '1'
 
 
 def create_app(test_config=None):
@@ -22,13 +22,17 @@ def create_app(test_config=None):
     app.register_blueprint(movies_blueprint)
     app.register_blueprint(genders_blueprint)
     app.register_blueprint(castings_blueprint)
+    app.register_blueprint(metrics_blueprint)
+    unit_of_work.init_app(app)
+    notifications.init_app(app)
     CORS(app)
-    if test_mode == 1:
-        setup_db(app, test_mode=True)
-    else:
-        setup_db(app)
-        db = get_db()
-        migrate = get_migrate()
+    app.cli.add_command(import_csv_command)
+    # the database and migrations are the single instances of models.py.
+    # the only connection opened before the first request loads the lookup
+    # tables, and is closed before gunicorn forks its workers (see
+    # gunicorn.conf.py), which inherit the loaded tables
+    setup_db(app, test_mode=bool(test_config))
+    load_lookups(app)
 
     return app
 
@@ -40,8 +44,8 @@ APP = create_app(test_config=test_mode)
 def after_request(response):
     response.headers.add('Access-Control-Allow-Headers',
                          'Content-Type, Authorization, true')
-    response.headers.add(
-        'Access-Control-Allow-Methods', 'GET, OPTIONS, PATCH, DELETE, POST')
+    response.headers.add('Access-Control-Allow-Methods',
+                         'GET, OPTIONS, PATCH, DELETE, POST, PUT')
     return response
 
 
@@ -95,6 +99,16 @@ def error_422(error):
     }), 422
 
 
+@APP.errorhandler(413)
+def error_413(error):
+    message = 'payload too large'
+    return jsonify({
+        'success': False,
+        'error': 413,
+        'message': message.lower()
+    }), 413
+
+
 @APP.errorhandler(400)
 def error_400(error):
     message = 'bad request'
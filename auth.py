@@ -1,14 +1,33 @@
 import json
+import time
+import logging
+import hashlib
+import threading
+from collections import OrderedDict
 from functools import wraps
 from jose import jwt
 import os
 from flask import request, abort
 from urllib.request import urlopen
+from shared_cache import SharedCache
 
 AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN")
 API_AUDIENCE = os.getenv("API_AUDIENCE")
 AUTH0_CLIENTID = os.getenv("AUTH0_CLIENTID")
 ALGORITHMS = ["RS256"]
+JWKS_URL = os.getenv(
+    "JWKS_URL", f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+JWKS_TTL = int(os.getenv("JWKS_TTL", 600))
+JWKS_MIN_REFRESH = int(os.getenv("JWKS_MIN_REFRESH", 30))
+JWKS_MAX_STALE = int(os.getenv("JWKS_MAX_STALE", 86400))
+JWKS_FAILURE_THRESHOLD = int(os.getenv("JWKS_FAILURE_THRESHOLD", 3))
+JWKS_COOLDOWN = int(os.getenv("JWKS_COOLDOWN", 30))
+JWKS_TIMEOUT = float(os.getenv("JWKS_TIMEOUT", 5))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 1024))
+TOKEN_CACHE_BYTES = int(os.getenv("TOKEN_CACHE_BYTES", 4 * 1024 * 1024))
+JWT_CRYPTO_BACKEND = os.getenv("JWT_CRYPTO_BACKEND", "auto")
+
+logger = logging.getLogger(__name__)
 
 
 class AuthError(Exception):
@@ -23,6 +42,399 @@ class AuthError(Exception):
         }
 
 
+def rsa_backends():
+    # python-jose rsa key classes that can be imported, fastest first
+    backends = {}
+    try:
+        from jose.backends.cryptography_backend import CryptographyRSAKey
+        backends['cryptography'] = CryptographyRSAKey
+    except ImportError:
+        pass
+    try:
+        from jose.backends.rsa_backend import RSAKey
+        backends['rsa'] = RSAKey
+    except ImportError:
+        pass
+    return backends
+
+
+def select_backend(name=JWT_CRYPTO_BACKEND):
+    backends = rsa_backends()
+    if not backends:
+        raise RuntimeError('no rsa backend available for python-jose')
+    if name == 'auto':
+        name = next(iter(backends))
+    elif name not in backends:
+        raise RuntimeError(f'rsa backend {name} is not available')
+    return name, backends[name]
+
+
+CRYPTO_BACKEND, RSAKey = select_backend()
+logger.info('verifying tokens with the %s rsa backend', CRYPTO_BACKEND)
+
+
+def build_key(jwk):
+    return RSAKey({
+        'kty': jwk['kty'],
+        'kid': jwk['kid'],
+        'use': jwk.get('use', 'sig'),
+        'n': jwk['n'],
+        'e': jwk['e']
+    }, ALGORITHMS[0])
+
+
+class CircuitBreaker():
+    # opens after `threshold` consecutive failures and lets a single
+    # trial call through once `cooldown` seconds have passed
+    def __init__(self, threshold=JWKS_FAILURE_THRESHOLD,
+                 cooldown=JWKS_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        return self.state() != 'open'
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class JWKSStore():
+    # keeps the signing keys in memory, indexed by kid, and only goes
+    # back to the jwks endpoint when the ttl runs out or an unknown kid
+    # shows up (at most once every min_refresh seconds for unknown kids).
+    # only one fetch runs at a time, expired keys are served for up to
+    # max_stale seconds while a background refresh runs, and the breaker
+    # stops fetches while the endpoint is failing. a fetch slower than
+    # timeout seconds counts as a failure, so a hanging endpoint cannot
+    # hold the lock that callers without keys wait on.
+    def __init__(self, url=JWKS_URL, ttl=JWKS_TTL,
+                 min_refresh=JWKS_MIN_REFRESH, max_stale=JWKS_MAX_STALE,
+                 breaker=None, shared=None, timeout=JWKS_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+        self.ttl = ttl
+        self.min_refresh = min_refresh
+        self.max_stale = max_stale
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.shared = shared
+        self.keys = {}
+        self.fetched_at = None
+        # wall clock time the current key set was fetched, by any worker
+        self.fetched_wall = 0.0
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.counters = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'shared_hits': 0,
+            'failures': 0,
+            'short_circuits': 0
+        }
+
+    def fetch(self):
+        shared = self.fetch_shared()
+        if shared is not None:
+            return shared
+        with urlopen(self.url, timeout=self.timeout) as response:
+            document = response.read()
+        keys = self.build(json.loads(document))
+        fetched_wall = time.time()
+        if self.shared is not None:
+            self.shared.put_jwks(document, fetched_wall)
+        return keys, fetched_wall
+
+    def fetch_shared(self):
+        # a key set another worker fetched after ours is used as is
+        if self.shared is None:
+            return None
+        try:
+            cached = self.shared.get_jwks(newer_than=self.fetched_wall,
+                                          max_age=self.ttl)
+            if cached is None:
+                return None
+            document, fetched_wall = cached
+            keys = self.build(json.loads(document))
+        except Exception:
+            logger.warning('ignoring unreadable shared jwks document')
+            return None
+        self.counters['shared_hits'] += 1
+        return keys, fetched_wall
+
+    def build(self, jwks):
+        # public key objects are built once per kid, not once per request
+        keys = {}
+        for jwk in jwks['keys']:
+            if jwk.get('kty') != 'RSA' or 'kid' not in jwk:
+                continue
+            try:
+                keys[jwk['kid']] = build_key(jwk)
+            except Exception:
+                logger.warning('skipping unusable signing key %s', jwk['kid'])
+        return keys
+
+    def refresh(self, wait=True):
+        generation = self.generation
+        if not self.lock.acquire(blocking=wait):
+            return False
+        try:
+            if self.generation != generation:
+                # another caller refreshed the keys while we waited
+                return True
+            if not self.breaker.allow():
+                self.counters['short_circuits'] += 1
+                return False
+            try:
+                keys, fetched_wall = self.fetch()
+            except Exception:
+                self.counters['failures'] += 1
+                self.breaker.failure()
+                return False
+            self.breaker.success()
+            self.keys = keys
+            self.fetched_at = time.monotonic() - max(
+                0.0, time.time() - fetched_wall)
+            self.fetched_wall = fetched_wall
+            self.generation += 1
+            self.counters['refreshes'] += 1
+        finally:
+            self.lock.release()
+        self.notify()
+        return True
+
+    def notify(self):
+        kids = set(self.keys)
+        for listener in self.listeners:
+            listener(kids)
+
+    def refresh_in_background(self):
+        if self.lock.locked() or not self.breaker.allow():
+            return
+        threading.Thread(target=self.refresh, kwargs={'wait': False},
+                         daemon=True).start()
+
+    def age(self):
+        if self.fetched_at is None:
+            return None
+        return time.monotonic() - self.fetched_at
+
+    def expired(self):
+        age = self.age()
+        return age is None or age >= self.ttl
+
+    def usable(self):
+        age = self.age()
+        return age is not None and age < self.ttl + self.max_stale
+
+    def get(self, kid):
+        if not self.usable():
+            self.counters['misses'] += 1
+            if not self.refresh() and self.keys:
+                # too stale to keep serving
+                self.keys = {}
+                self.notify()
+            return self.keys.get(kid)
+        if kid in self.keys:
+            if self.expired():
+                self.counters['stale_hits'] += 1
+                self.refresh_in_background()
+            else:
+                self.counters['hits'] += 1
+            return self.keys[kid]
+        self.counters['misses'] += 1
+        if self.age() >= self.min_refresh:
+            self.refresh()
+        return self.keys.get(kid)
+
+    def available(self):
+        return len(self.keys) > 0
+
+    def clear(self):
+        with self.lock:
+            self.keys = {}
+            self.fetched_at = None
+            self.fetched_wall = 0.0
+            self.generation += 1
+        self.notify()
+
+    def stats(self):
+        return {
+            **self.counters,
+            'keys': len(self.keys),
+            'age': self.age(),
+            'breaker': self.breaker.state(),
+            'backend': CRYPTO_BACKEND
+        }
+
+
+class TokenCache():
+    # lru cache of verified token payloads keyed by the sha256 digest of
+    # the token. entries live until the token's exp claim, the cache is
+    # bounded both by entry count and by an approximate byte budget.
+    # digests of verified tokens are also published to the shared cache
+    # so other workers can skip the signature check for the same token.
+    # a token is only served while the key store still has its kid.
+    def __init__(self, max_entries=TOKEN_CACHE_SIZE,
+                 max_bytes=TOKEN_CACHE_BYTES, shared=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.kids = None
+        # returns the signing key of a kid, None once it is gone
+        self.key = None
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.counters = {
+            'hits': 0,
+            'shared_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'revocations': 0
+        }
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def get(self, token):
+        digest = self.digest(token)
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is not None and entry[2] <= time.time():
+                self.remove(digest)
+                self.counters['expirations'] += 1
+                entry = None
+        if entry is not None:
+            # looked up without the lock, the key store may refresh and
+            # revoke tokens meanwhile
+            trusted = self.trusted(entry[1])
+            with self.lock:
+                if not trusted:
+                    if digest in self.entries:
+                        self.remove(digest)
+                    self.counters['misses'] += 1
+                    return None
+                if digest in self.entries:
+                    self.entries.move_to_end(digest)
+                self.counters['hits'] += 1
+            return entry[0]
+        payload = self.get_shared(token, digest)
+        if payload is None:
+            self.counters['misses'] += 1
+            return None
+        self.counters['shared_hits'] += 1
+        self.put(token, payload, publish=False)
+        return payload
+
+    def get_shared(self, token, digest):
+        # another worker has verified this exact token, so only its claims
+        # need decoding, provided it was signed with a key we still trust
+        if self.shared is None or self.kids is None:
+            return None
+        try:
+            if not self.shared.has_token(digest):
+                return None
+            kid = jwt.get_unverified_header(token).get('kid')
+            if kid not in self.kids or not self.trusted(kid):
+                return None
+            payload = jwt.get_unverified_claims(token)
+        except Exception:
+            return None
+        expires_at = payload.get('exp')
+        if not isinstance(expires_at, (int, float)):
+            return None
+        if expires_at <= time.time():
+            return None
+        return payload
+
+    def trusted(self, kid):
+        # whether the key a cached token was signed with is still served
+        # by the key store, asking it also keeps its keys fresh
+        return self.key is None or self.key(kid) is not None
+
+    def put(self, token, payload, publish=True):
+        expires_at = payload.get('exp')
+        if not isinstance(expires_at, (int, float)):
+            return
+        kid = jwt.get_unverified_header(token).get('kid')
+        size = len(token) + len(json.dumps(payload))
+        if size > self.max_bytes:
+            return
+        digest = self.digest(token)
+        with self.lock:
+            if digest in self.entries:
+                self.remove(digest)
+            self.entries[digest] = (payload, kid, expires_at, size)
+            self.size += size
+            while (len(self.entries) > self.max_entries
+                   or self.size > self.max_bytes):
+                self.remove(next(iter(self.entries)))
+                self.counters['evictions'] += 1
+        if publish and self.shared is not None:
+            try:
+                self.shared.put_token(digest, expires_at)
+            except OSError:
+                logger.warning('could not publish token to shared cache')
+
+    def remove(self, digest):
+        entry = self.entries.pop(digest)
+        self.size -= entry[3]
+
+    def retain_kids(self, kids):
+        # drop tokens signed by keys that have left the key store
+        rotated = self.kids is not None and len(self.kids - kids) > 0
+        self.kids = set(kids)
+        with self.lock:
+            revoked = [digest for digest, entry in self.entries.items()
+                       if entry[1] not in kids]
+            for digest in revoked:
+                self.remove(digest)
+            self.counters['revocations'] += len(revoked)
+        if rotated and self.shared is not None:
+            self.shared.clear_tokens()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        return {
+            **self.counters,
+            'entries': len(self.entries),
+            'bytes': self.size
+        }
+
+
+# workers only share tokens and keys with the same issuer, audience and
+# jwks url
+shared_cache = SharedCache.open(namespace=json.dumps(
+    [f'https://{AUTH0_DOMAIN}/', API_AUDIENCE, JWKS_URL]))
+jwks_store = JWKSStore(shared=shared_cache)
+token_cache = TokenCache(shared=shared_cache)
+jwks_store.listeners.append(token_cache.retain_kids)
+token_cache.key = jwks_store.get
+
+
 def get_token_auth_header():
     auth = request.headers.get('Authorization', None)
     if auth is None:
@@ -51,23 +463,14 @@ def check_permissions(permission, payload):
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         abort(401, 'Authorization malformed.')
     else:
-        for key in jwks['keys']:
-            if key['kid'] == unverified_header['kid']:
-                rsa_key = {
-                    'kty': key['kty'],
-                    'kid': key['kid'],
-                    'use': key['use'],
-                    'n': key['n'],
-                    'e': key['e']
-                }
-        if rsa_key:
+        rsa_key = jwks_store.get(unverified_header['kid'])
+        if rsa_key is None and not jwks_store.available():
+            raise AuthError('authorization service unavailable.', 503)
+        if rsa_key is not None:
             try:
                 payload = jwt.decode(
                     token,
@@ -88,12 +491,19 @@ def verify_decode_jwt(token):
 
 
 def requires_auth(permission=''):
+    # permission may also be a list, every permission in it is required
+    permissions = [permission] if isinstance(permission, str) else permission
+
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
             token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            payload = token_cache.get(token)
+            if payload is None:
+                payload = verify_decode_jwt(token)
+                token_cache.put(token, payload)
+            for required in permissions:
+                check_permissions(required, payload)
             return f(*args, **kwargs)
 
         return wrapper
@@ -0,0 +1,161 @@
+# loads a synthetic dataset into a scratch schema of a postgres database
+# and prints the query plans and execution times of the lookups covered
+# by migrations 4b1e9d2c7a53 and 8e2f4a6b1c90, without and then with their
+# indexes.
+# the schema is dropped afterwards, application tables are not touched.
+#
+#   DATABASE_URL=postgresql://... python3 benchmarks/index_plans.py [scale]
+#
+# scale 1 is 10,000 movies, 100,000 actors and 1,000,000 castings.
+import os
+import sys
+import time
+from sqlalchemy import create_engine, text
+
+SCHEMA = 'index_bench'
+
+TABLES = [
+    '''CREATE TABLE gender (
+        id serial PRIMARY KEY,
+        name varchar NOT NULL UNIQUE)''',
+    '''CREATE TABLE movie (
+        id serial PRIMARY KEY,
+        title varchar NOT NULL UNIQUE,
+        release_date timestamp NOT NULL)''',
+    '''CREATE TABLE actor (
+        id serial PRIMARY KEY,
+        name varchar NOT NULL,
+        dob timestamp NOT NULL,
+        gender_id integer NOT NULL REFERENCES gender (id))''',
+    '''CREATE TABLE casting (
+        id serial PRIMARY KEY,
+        actor_id integer NOT NULL REFERENCES actor (id),
+        movie_id integer NOT NULL REFERENCES movie (id),
+        casting_date timestamp NOT NULL,
+        recast_yn boolean NOT NULL,
+        CONSTRAINT "UX_actor_movie_date"
+            UNIQUE (actor_id, movie_id, casting_date))'''
+]
+
+DATA = [
+    '''INSERT INTO gender (name)
+       SELECT 'gender ' || g FROM generate_series(1, 4) g''',
+    '''INSERT INTO movie (title, release_date)
+       SELECT 'movie ' || m,
+              timestamp '1950-01-01' + (random() * 27000) * interval '1 day'
+       FROM generate_series(1, :movies) m''',
+    '''INSERT INTO actor (name, dob, gender_id)
+       SELECT 'actor ' || a,
+              timestamp '1930-01-01' + (random() * 27000) * interval '1 day',
+              1 + a % 3
+       FROM generate_series(1, :actors) a''',
+    '''INSERT INTO casting (actor_id, movie_id, casting_date, recast_yn)
+       SELECT 1 + (c * 7919::bigint) % :actors,
+              1 + (c * 104729::bigint) % :movies,
+              timestamp '2000-01-01' + c * interval '1 minute', c % 10 = 0
+       FROM generate_series(1, :castings) c''',
+    # a movie and a gender nothing refers to, so they can be deleted
+    '''INSERT INTO movie (title, release_date)
+       VALUES ('unreferenced', '2001-01-01')''',
+    '''INSERT INTO gender (name) VALUES ('unreferenced')'''
+]
+
+# kept in step with migrations/versions/4b1e9d2c7a53 and 8e2f4a6b1c90
+INDEXES = [
+    'CREATE INDEX ix_casting_movie_id ON casting (movie_id)',
+    'CREATE INDEX ix_casting_casting_date ON casting (casting_date, id)',
+    'CREATE INDEX ix_actor_gender_id ON actor (gender_id)',
+    'CREATE INDEX ix_movie_release_date ON movie (release_date, id)',
+    'CREATE INDEX ix_actor_dob ON actor (dob, id)'
+]
+
+ANALYZE = 'ANALYZE gender, movie, actor, casting'
+
+QUERIES = [
+    ('castings of a movie',
+     '''SELECT * FROM casting WHERE movie_id = 42
+        ORDER BY id LIMIT 100'''),
+    ('castings in a date range',
+     '''SELECT * FROM casting
+        WHERE casting_date >= '2000-03-01' AND casting_date <= '2000-03-02'
+        ORDER BY casting_date, id LIMIT 100'''),
+    ('movies released in a date range',
+     '''SELECT * FROM movie
+        WHERE release_date > '1990-01-01' AND release_date < '1990-03-01'
+        ORDER BY release_date, id LIMIT 100'''),
+    ('actors aged 30 to 31 (min_age, max_age)',
+     '''SELECT * FROM actor
+        WHERE dob < '1995-01-02' AND dob >= '1993-01-02'
+        ORDER BY id LIMIT 100'''),
+    ('delete a movie (casting fk check)',
+     '''DELETE FROM movie WHERE title = 'unreferenced' '''),
+    ('delete a gender (actor fk check)',
+     '''DELETE FROM gender WHERE name = 'unreferenced' ''')
+]
+
+
+def database_url():
+    url = os.getenv('DATABASE_URL', '')
+    if len(url) == 0:
+        sys.exit('DATABASE_URL must point to a postgres database')
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def explain(connection, sql):
+    # run inside a transaction that is rolled back, so deletes are undone
+    transaction = connection.begin()
+    try:
+        rows = connection.execute(
+            text('EXPLAIN (ANALYZE, BUFFERS) ' + sql)).fetchall()
+    finally:
+        transaction.rollback()
+    return [row[0] for row in rows]
+
+
+def report(connection, label):
+    print(f'\n=== {label} ===')
+    for name, sql in QUERIES:
+        plan = explain(connection, sql)
+        print(f'\n-- {name}')
+        for line in plan:
+            if ('Scan' in line or 'Trigger' in line or 'Execution' in line
+                    or line == plan[0]):
+                print('   ' + line.strip())
+
+
+def main():
+    scale = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    sizes = {
+        'movies': int(10000 * scale),
+        'actors': int(100000 * scale),
+        'castings': int(1000000 * scale)
+    }
+    engine = create_engine(database_url())
+    with engine.connect() as connection:
+        connection.execute(text(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE'))
+        connection.execute(text(f'CREATE SCHEMA {SCHEMA}'))
+        connection.execute(text(f'SET search_path TO {SCHEMA}'))
+        try:
+            started = time.monotonic()
+            with connection.begin():
+                for statement in TABLES:
+                    connection.execute(text(statement))
+                for statement in DATA:
+                    connection.execute(text(statement), sizes)
+            connection.execute(text(ANALYZE))
+            print(f'loaded {sizes} in {time.monotonic() - started:.1f}s')
+            report(connection, 'without indexes')
+            started = time.monotonic()
+            for statement in INDEXES:
+                connection.execute(text(statement))
+            connection.execute(text(ANALYZE))
+            print(f'\nbuilt indexes in {time.monotonic() - started:.1f}s')
+            report(connection, 'with indexes')
+        finally:
+            connection.execute(text(f'DROP SCHEMA {SCHEMA} CASCADE'))
+
+
+if __name__ == '__main__':
+    main()
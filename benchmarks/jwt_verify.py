@@ -0,0 +1,66 @@
+# compares the cost of verifying an RS256 token with every python-jose
+# rsa backend that is installed, both the old way (building the key from
+# the jwk on every call) and with a key object built once per kid.
+#
+#   python3 benchmarks/jwt_verify.py [iterations]
+import os
+import sys
+import time
+import timeit
+import rsa
+from jose import jwt
+from jose.utils import long_to_base64
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from auth import rsa_backends  # noqa: E402
+
+ISSUER = 'https://bench.example/'
+AUDIENCE = 'bench'
+
+
+def make_token():
+    public_key, private_key = rsa.newkeys(2048)
+    pem = private_key.save_pkcs1().decode('ascii')
+    claims = {
+        'iss': ISSUER,
+        'aud': AUDIENCE,
+        'exp': int(time.time()) + 3600,
+        'permissions': ['get:movies']
+    }
+    token = jwt.encode(claims, pem, algorithm='RS256',
+                       headers={'kid': 'bench'})
+    jwk = {
+        'kty': 'RSA',
+        'kid': 'bench',
+        'use': 'sig',
+        'n': long_to_base64(public_key.n).decode('ascii'),
+        'e': long_to_base64(public_key.e).decode('ascii')
+    }
+    return token, jwk
+
+
+def verify(token, key):
+    return jwt.decode(token, key, algorithms=['RS256'], audience=AUDIENCE,
+                      issuer=ISSUER)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    token, jwk = make_token()
+    print(f'{"backend":<14}{"key":<10}{"per call (us)":>16}{"calls/s":>12}')
+    for name, key_class in rsa_backends().items():
+        prebuilt = key_class(jwk, 'RS256')
+        cases = {
+            'per call': lambda: verify(token, key_class(jwk, 'RS256')),
+            'prebuilt': lambda: verify(token, prebuilt)
+        }
+        for label, case in cases.items():
+            seconds = min(timeit.repeat(case, number=iterations, repeat=3))
+            per_call = seconds / iterations
+            print(f'{name:<14}{label:<10}{per_call * 1e6:>16.1f}'
+                  f'{1 / per_call:>12.0f}')
+
+
+if __name__ == '__main__':
+    main()
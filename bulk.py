@@ -0,0 +1,215 @@
+import os
+from flask import request, abort, jsonify
+from sqlalchemy import tuple_, or_, literal_column
+from sqlalchemy.dialects.postgresql import insert as upsert
+from sqlalchemy.exc import SQLAlchemyError
+from models import get_db
+from generations import written
+
+BATCH_LIMIT = int(os.getenv('BATCH_LIMIT', 5000))
+INSERT_CHUNK = int(os.getenv('INSERT_CHUNK', 1000))
+
+
+def batch_items():
+    items = request.get_json()
+    if not isinstance(items, list) or len(items) == 0:
+        abort(400)
+    if len(items) > BATCH_LIMIT:
+        abort(413)
+    return items
+
+
+def parse_item(model, item):
+    # the column values of one record, or a ValueError naming the problem
+    if not isinstance(item, dict):
+        raise ValueError('expected an object')
+    row = {}
+    for name, value_input in model.inputs().items():
+        value = item.get(name, None)
+        if value is None:
+            if value_input.required:
+                raise ValueError(f'missing {name}')
+            row[name] = value_input.default
+            continue
+        try:
+            row[name] = value_input.parse(value)
+        except (ValueError, TypeError, OverflowError):
+            raise ValueError(f'invalid {name}')
+    return row
+
+
+def check_references(model, rows, errors):
+    # one query per foreign key for the whole batch
+    session = get_db().session
+    for name, value_input in model.inputs().items():
+        target = value_input.references
+        if target is None:
+            continue
+        ids = {row[name] for row in rows.values()}
+        found = {row.id for row in
+                 session.query(target.id).filter(target.id.in_(ids))}
+        for index, row in list(rows.items()):
+            if row[name] not in found:
+                errors[index] = f'unknown {name}'
+                del rows[index]
+
+
+def drop_duplicates(key, rows, errors):
+    # a statement may not insert or update the same row twice
+    seen = set()
+    for index, row in list(rows.items()):
+        value = tuple(row[name] for name in key)
+        if value in seen:
+            errors[index] = f'duplicate {", ".join(key)}'
+            del rows[index]
+        seen.add(value)
+
+
+def check_unique_keys(model, rows, errors):
+    # duplicates within the batch and rows already stored, one query per
+    # unique key for the whole batch
+    session = get_db().session
+    for key in model.unique_keys():
+        columns = [getattr(model, name) for name in key]
+        drop_duplicates(key, rows, errors)
+        if len(rows) == 0:
+            continue
+        stored = set(session.query(*columns).filter(tuple_(*columns).in_(
+            [tuple(row[name] for name in key) for row in rows.values()])))
+        for index, row in list(rows.items()):
+            if tuple(row[name] for name in key) in stored:
+                errors[index] = f'{", ".join(key)} already exists'
+                del rows[index]
+
+
+def insert_rows(model, rows):
+    # multi-row inserts of INSERT_CHUNK rows returning the new ids, in the
+    # order of the values, or one insert per row where the database has no
+    # RETURNING
+    session = get_db().session
+    table = model.__table__
+    if not get_db().engine.dialect.implicit_returning:
+        return [session.execute(table.insert().values(row))
+                .inserted_primary_key[0] for row in rows]
+    ids = []
+    for start in range(0, len(rows), INSERT_CHUNK):
+        statement = table.insert().values(rows[start:start + INSERT_CHUNK])
+        ids.extend(session.execute(statement.returning(table.c.id))
+                   .scalars())
+    return ids
+
+
+def collect(model, items):
+    # the parsed rows of the valid items and the reasons for the others,
+    # both keyed by position
+    rows = {}
+    errors = {}
+    for index, item in enumerate(items):
+        try:
+            rows[index] = parse_item(model, item)
+        except ValueError as error:
+            errors[index] = str(error)
+    check_references(model, rows, errors)
+    return rows, errors
+
+
+def error_list(errors):
+    return [{'index': index, 'message': errors[index]}
+            for index in sorted(errors)]
+
+
+def create_batch(model):
+    # creates the valid records of a json array in the request's transaction.
+    # created lists the new id of every item (null where it was rejected)
+    # and errors the position and reason of every rejected one
+    items = batch_items()
+    rows, errors = collect(model, items)
+    check_unique_keys(model, rows, errors)
+    created = [None] * len(items)
+    try:
+        indexes = sorted(rows)
+        ids = insert_rows(model, [rows[index] for index in indexes])
+    except SQLAlchemyError:
+        abort(422)
+    for index, record_id in zip(indexes, ids):
+        created[index] = record_id
+    if ids:
+        written(model)
+    return jsonify({
+        'success': True,
+        'created': created,
+        'errors': error_list(errors)
+    })
+
+
+def upsert_rows(model, key, rows):
+    # INSERT ... ON CONFLICT (key) DO UPDATE, touching only the rows that
+    # differ. xmax is 0 for the rows the statement inserted, so RETURNING
+    # tells created rows from updated ones and unchanged rows return nothing
+    session = get_db().session
+    table = model.__table__
+    values = [name for name in model.inputs() if name not in key]
+    counts = {'created': 0, 'updated': 0}
+    for start in range(0, len(rows), INSERT_CHUNK):
+        statement = upsert(table).values(rows[start:start + INSERT_CHUNK])
+        if len(values) == 0:
+            statement = statement.on_conflict_do_nothing(index_elements=key)
+        else:
+            statement = statement.on_conflict_do_update(
+                index_elements=key,
+                set_={name: statement.excluded[name] for name in values},
+                where=or_(*[table.c[name].is_distinct_from(
+                    statement.excluded[name]) for name in values]))
+        returned = session.execute(statement.returning(
+            table.c.id, literal_column('xmax = 0').label('inserted')))
+        for row in returned:
+            counts['created' if row.inserted else 'updated'] += 1
+    return counts
+
+
+def merge_rows(model, key, rows):
+    # the same through the orm, for databases without ON CONFLICT
+    session = get_db().session
+    columns = [getattr(model, name) for name in key]
+    stored = {tuple(getattr(record, name) for name in key): record
+              for record in model.query.filter(tuple_(*columns).in_(
+                  [tuple(row[name] for name in key) for row in rows]))}
+    counts = {'created': 0, 'updated': 0}
+    for row in rows:
+        record = stored.get(tuple(row[name] for name in key), None)
+        if record is None:
+            session.execute(model.__table__.insert().values(row))
+            counts['created'] += 1
+        elif any(getattr(record, name) != value for name, value in
+                 row.items()):
+            for name, value in row.items():
+                setattr(record, name, value)
+            counts['updated'] += 1
+    return counts
+
+
+def sync_batch(model):
+    # creates or updates the records of a json array by natural key (the
+    # model's first unique key) in the request's transaction
+    items = batch_items()
+    rows, errors = collect(model, items)
+    key = list(model.unique_keys()[0])
+    drop_duplicates(key, rows, errors)
+    rows = [rows[index] for index in sorted(rows)]
+    try:
+        if get_db().engine.dialect.name == 'postgresql':
+            counts = upsert_rows(model, key, rows)
+        else:
+            counts = merge_rows(model, key, rows)
+            get_db().session.flush()
+    except SQLAlchemyError:
+        abort(422)
+    if counts['created'] or counts['updated']:
+        written(model)
+    return jsonify({
+        'success': True,
+        'created': counts['created'],
+        'updated': counts['updated'],
+        'unchanged': len(rows) - counts['created'] - counts['updated'],
+        'errors': error_list(errors)
+    })
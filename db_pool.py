@@ -0,0 +1,130 @@
+import os
+import time
+import logging
+import threading
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+# the gunicorn worker processes and threads per worker, which bound how
+# many connections a worker can use at once (one per request, see
+# unit_of_work). gunicorn reads WEB_CONCURRENCY itself
+WORKERS = int(os.getenv('WEB_CONCURRENCY', 2 * (os.cpu_count() or 1) + 1))
+THREADS = int(os.getenv('GUNICORN_THREADS', 4))
+# the share of postgres max_connections the api may use across all its
+# workers, 0 for no limit
+DB_MAX_CONNECTIONS = int(os.getenv('DB_MAX_CONNECTIONS', 0))
+DB_POOL_SIZE = os.getenv('DB_POOL_SIZE', '')
+DB_MAX_OVERFLOW = os.getenv('DB_MAX_OVERFLOW', '')
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+# each worker also holds a connection outside its pool, on which it
+# listens for the writes of other processes (see notifications.py)
+NOTIFY_ENABLED = os.getenv('NOTIFY_ENABLED', 'true').lower() == 'true'
+LISTENER_CONNECTIONS = 1 if NOTIFY_ENABLED else 0
+# upper bounds, in seconds, of the wait time histogram buckets
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+logger = logging.getLogger(__name__)
+
+
+def pool_sizes(workers=WORKERS, threads=THREADS,
+               max_connections=DB_MAX_CONNECTIONS,
+               reserved=LISTENER_CONNECTIONS):
+    # a connection per thread plus a little overflow for the cli and
+    # bursts, capped by each worker's share of max_connections less the
+    # connections it holds outside the pool
+    size = threads
+    overflow = max(1, threads // 2)
+    if max_connections > 0:
+        share = max_connections // max(workers, 1) - reserved
+        if share < 1:
+            logger.warning('%d connections cannot be shared by %d workers',
+                           max_connections, workers)
+            share = 1
+        size = min(size, share)
+        overflow = min(overflow, share - size)
+    if DB_POOL_SIZE:
+        size = int(DB_POOL_SIZE)
+    if DB_MAX_OVERFLOW:
+        overflow = int(DB_MAX_OVERFLOW)
+    return size, overflow
+
+
+def engine_options():
+    size, overflow = pool_sizes()
+    return {
+        'poolclass': TimedQueuePool,
+        'pool_size': size,
+        'max_overflow': overflow,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+        'pool_timeout': DB_POOL_TIMEOUT
+    }
+
+
+class WaitStats():
+    # a histogram of the time spent waiting for a pooled connection
+    def __init__(self, buckets=WAIT_BUCKETS) -> None:
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.timeouts = 0
+
+    def record(self, seconds):
+        index = 0
+        while index < len(self.buckets) and seconds > self.buckets[index]:
+            index += 1
+        with self.lock:
+            self.counts[index] += 1
+            self.total += seconds
+
+    def timeout(self):
+        with self.lock:
+            self.timeouts += 1
+
+    def stats(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.total
+            timeouts = self.timeouts
+        histogram = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            histogram.append({'le': bound, 'count': cumulative})
+        return {
+            'count': cumulative,
+            'seconds': total,
+            'timeouts': timeouts,
+            'histogram': histogram
+        }
+
+
+class TimedQueuePool(QueuePool):
+    # a QueuePool measuring how long each checkout waited for a connection
+    # (including opening one when the pool overflows)
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.waits = WaitStats()
+
+    def _do_get(self):
+        started = time.monotonic()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.waits.timeout()
+            raise
+        finally:
+            self.waits.record(time.monotonic() - started)
+
+    def stats(self):
+        return {
+            'size': self.size(),
+            'max_overflow': self._max_overflow,
+            'checked_in': self.checkedin(),
+            'checked_out': self.checkedout(),
+            'overflow': max(self.overflow(), 0),
+            'waits': self.waits.stats()
+        }
@@ -1,40 +1,45 @@
 from flask import Blueprint
-from models import Gender
+from models import Gender, gender_names
 from flask import request, abort, jsonify
 from auth import requires_auth
+from generations import conditional
+from listing import page_records, detail
+from writes import insert_record, update_record, delete_record, supplied
+from bulk import create_batch, sync_batch
 
 genders_blueprint = Blueprint('genders_blueprint', __name__)
 
 
 @genders_blueprint.route('/genders', methods=['GET'])
 @requires_auth(permission='get:genders')
+@conditional(Gender)
 def get_genders():
-    genders = Gender.query.all()
-    format_genders = [gender.format() for gender in genders]
+    format_genders, next_cursor = page_records(
+        Gender, gender_names.all().values())
     return jsonify({
         'success': True,
-        'genders': format_genders
+        'genders': format_genders,
+        'next': next_cursor
     })
 
 
 @genders_blueprint.route('/genders/<int:gender_id>', methods=['GET'])
 @requires_auth(permission='get:genders')
+@conditional(Gender)
 def get_gender(gender_id):
-    gender = Gender.query.filter(Gender.id == gender_id).one_or_none()
-    if gender is None:
+    format_gender = detail(Gender, gender_id)
+    if format_gender is None:
         abort(404)
     else:
-        format_genders = [gender.format()]
         return jsonify({
             'success': True,
-            'genders': format_genders
+            'genders': [format_gender]
         })
 
 
 @genders_blueprint.route('/genders', methods=['POST'])
 @requires_auth(permission='post:genders')
 def create_gender():
-    success = False
     body = request.get_json()
     if body is None:
         abort(400)
@@ -43,86 +48,56 @@ def create_gender():
         if name is None:
             abort(400)
         else:
-            gender = Gender(name=name)
-            try:
-                gender.insert()
-                gender.apply()
-                gender.refresh()
-                format_genders = [gender.format()]
-                success = True
-            finally:
-                if success:
-                    gender.dispose()
-                    return jsonify({
-                        'success': success,
-                        'created': gender.id,
-                        'genders': format_genders
-                    })
-                else:
-                    gender.rollback()
-                    gender.dispose()
-                    abort(422)
+            format_gender = insert_record(Gender, {'name': name})
+            return jsonify({
+                'success': True,
+                'created': format_gender['id'],
+                'genders': [format_gender]
+            })
+
+
+@genders_blueprint.route('/genders/batch', methods=['POST'])
+@requires_auth(permission='post:genders')
+def create_genders():
+    return create_batch(Gender)
+
+
+@genders_blueprint.route('/genders/sync', methods=['PUT'])
+@requires_auth(permission=['post:genders', 'patch:genders'])
+def sync_genders():
+    return sync_batch(Gender)
 
 
 @genders_blueprint.route('/genders/<int:gender_id>', methods=['PATCH'])
 @requires_auth(permission='patch:genders')
 def modify_gender(gender_id):
-    success = False
     body = request.get_json()
     if body is None:
         abort(400)
     else:
-        name = body.get('name', None)
-        if name is None:
+        values = supplied(body, ['name'])
+        if len(values) == 0:
             abort(400)
         else:
-            gender = Gender.query.filter(Gender.id == gender_id).one_or_none()
-            if gender is None:
+            format_gender = update_record(Gender, gender_id, values)
+            if format_gender is None:
                 abort(422)
             else:
-                try:
-                    gender.name = name
-                    gender.apply()
-                    format_genders = [gender.format()]
-                    success = True
-                finally:
-                    if success:
-                        gender.dispose()
-                        return jsonify({
-                            'success': success,
-                            'modified': gender_id,
-                            'genders': format_genders
-                        })
-                    else:
-                        gender.rollback()
-                        gender.dispose()
-                        abort(422)
+                return jsonify({
+                    'success': True,
+                    'modified': gender_id,
+                    'genders': [format_gender]
+                })
 
 
 @genders_blueprint.route('/genders/<int:gender_id>', methods=['DELETE'])
 @requires_auth(permission='delete:genders')
 def delete_gender(gender_id):
-    success = False
-    if gender_id is None:
-        abort(400)
+    if delete_record(Gender, gender_id) is None:
+        abort(422)
     else:
-        gender = Gender.query.filter(Gender.id == gender_id).one_or_none()
-        if gender is None:
-            abort(422)
-        else:
-            try:
-                gender.delete()
-                gender.apply()
-                success = True
-            finally:
-                if success:
-                    gender.dispose()
-                    return jsonify({
-                        'success': success,
-                        'deleted': gender_id,
-                        'genders': []
-                    })
-                else:
-                    gender.rollback()
-                    gender.dispose()
-                    abort(422)
+        return jsonify({
+            'success': True,
+            'deleted': gender_id,
+            'genders': []
+        })
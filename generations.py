@@ -0,0 +1,172 @@
+import os
+import hashlib
+import threading
+from itertools import chain
+from functools import wraps
+from flask import request, make_response
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import Pool
+from auth import shared_cache
+from models import get_db, gender_names, reference_date
+from response_cache import response_cache
+from row_cache import row_cache
+
+
+class Generations():
+    # a counter per table, bumped after every commit that wrote to the
+    # table. the counters live in the shared cache file so every worker on
+    # the host agrees on them, or in the process when there is no such file.
+    # the epoch changes whenever the counters start again from zero, so a
+    # restart never hands out a tag that was used for other data.
+    # listeners are called with the names of the tables that changed,
+    # whether the write was committed here or elsewhere
+    def __init__(self, shared=None) -> None:
+        self.shared = shared
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.epoch = int.from_bytes(os.urandom(8), 'little')
+        self.listeners = []
+
+    def get(self, names):
+        if self.shared is not None:
+            return self.shared.get_generations(names)
+        with self.lock:
+            return self.epoch, [self.counters.get(name, 0) for name in names]
+
+    def bump(self, names):
+        if self.shared is not None:
+            self.shared.bump_generations(names)
+            return
+        with self.lock:
+            for name in names:
+                self.counters[name] = self.counters.get(name, 0) + 1
+
+    def origin(self):
+        # the name of the processes sharing these counters, which the
+        # write triggers put in front of their notifications
+        return f'casting-api:{self.get([])[0]}'
+
+    def changed(self, names, bump=True):
+        if bump:
+            self.bump(names)
+        for listener in self.listeners:
+            listener(names)
+
+    def stats(self, names):
+        return dict(zip(names, self.get(names)[1]))
+
+
+generations = Generations(shared=shared_cache)
+generations.listeners.append(response_cache.invalidate)
+generations.listeners.append(gender_names.invalidate)
+gender_names.current = lambda: generations.get(['gender'])
+generations.listeners.append(row_cache.invalidate)
+
+
+def tables(model):
+    # the tables a response about model reads: its own and the ones its
+    # fields are joined to or looked up in
+    names = {model.__tablename__}
+    for field in model.fields().values():
+        names.update(target.__tablename__ for target in field.joins)
+        names.update(target.__tablename__ for target in field.lookups)
+    return sorted(names)
+
+
+@event.listens_for(Pool, 'connect')
+def name_connection(dbapi_connection, connection_record):
+    # postgres connections are named after the origin of the counters, so
+    # notifications of our own writes can be told from those of other hosts
+    if getattr(dbapi_connection, 'server_version', None) is None:
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("SELECT set_config('application_name', %s, false)",
+                   (generations.origin(),))
+    cursor.close()
+    dbapi_connection.commit()
+
+
+def dated(model):
+    # whether responses about model change with the reference date
+    return any(field.dated for field in model.fields().values()) or \
+        any(column_filter.dated for column_filter in model.filters().values())
+
+
+def mark_written(session, name):
+    session.info.setdefault('written', set()).add(name)
+
+
+def written(model):
+    # marks model's table as written in the current transaction, its
+    # generation is bumped once the transaction commits
+    mark_written(get_db().session, model.__tablename__)
+
+
+@event.listens_for(Session, 'after_flush')
+def flushed(session, flush_context):
+    # records written through the orm mark their tables themselves
+    for record in chain(session.new, session.dirty, session.deleted):
+        mark_written(session, record.__tablename__)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def executed(orm_execute_state):
+    # and so do query.update() and query.delete()
+    if orm_execute_state.is_orm_statement and (
+            orm_execute_state.is_update or orm_execute_state.is_delete):
+        mark_written(orm_execute_state.session,
+                     orm_execute_state.bind_mapper.local_table.name)
+
+
+@event.listens_for(Session, 'after_commit')
+def bump_written(session):
+    names = session.info.pop('written', None)
+    if names:
+        generations.changed(sorted(names))
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_written(session):
+    session.info.pop('written', None)
+
+
+def entity_tag(names, by_date=False):
+    # a strong tag for the representation at the current url, which only
+    # changes when one of the tables it reads is written, or every day
+    # when it holds ages
+    epoch, counters = generations.get(names)
+    key = f'{epoch}:{counters}:{request.full_path}'
+    if by_date:
+        key += f':{reference_date().isoformat()}'
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def conditional(model):
+    # tags GET responses about model and answers 304 when the client
+    # already holds the current tag, before the view reads anything, or
+    # the response cached under the current tag. the tag is taken before
+    # the view runs, a write committed in between only makes the next
+    # request miss
+    names = tables(model)
+    by_date = dated(model)
+
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            etag = entity_tag(names, by_date)
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+            else:
+                response = response_cache.get(request.full_path, etag)
+            if response is None:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response_cache.put(request.full_path, etag, names, response)
+            response.set_etag(etag)
+            return response
+
+        return wrapper
+
+    return decorator
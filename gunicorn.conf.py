@@ -0,0 +1,39 @@
+# gunicorn settings, read by default from the working directory:
+#
+#   gunicorn app:APP
+#
+# every value can be overridden on the command line.
+import os
+from db_pool import WORKERS, THREADS
+
+bind = f"0.0.0.0:{os.getenv('PORT', 8080)}"
+
+# threaded workers, so a request waiting on postgres or on the jwks
+# endpoint does not hold up the others. the database pool is sized from
+# the same WEB_CONCURRENCY and GUNICORN_THREADS (see db_pool.py)
+worker_class = 'gthread'
+workers = WORKERS
+threads = THREADS
+
+# import the app once in the master, workers are forked with it loaded
+preload_app = True
+
+# recycle workers after a number of requests, with jitter so they do not
+# all restart at once
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+
+accesslog = '-'
+
+
+def pre_fork(server, worker):
+    # connections opened by the master must not be shared with the workers,
+    # close them before forking so each worker starts with an empty pool
+    from app import APP
+    from models import get_db
+    with APP.app_context():
+        get_db().engine.dispose()
@@ -0,0 +1,230 @@
+import io
+import os
+import csv
+import time
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import text
+from bulk import check_references, check_unique_keys
+from generations import written
+from models import get_db, Movie, Gender, Actor, Casting
+from models import parse_id, parse_flag
+
+IMPORT_BATCH = int(os.getenv('IMPORT_BATCH', 5000))
+ERROR_SAMPLES = 100
+
+IMPORTS = {
+    'movies': Movie,
+    'genders': Gender,
+    'actors': Actor,
+    'castings': Casting
+}
+
+
+class Lookup():
+    # a csv column holding the natural key of the record a foreign key
+    # refers to, resolved to its id a batch at a time
+    def __init__(self, target, column):
+        self.target = target
+        self.column = column
+
+
+def lookups(model):
+    if model is Actor:
+        return {'gender': Lookup('gender_id', Gender.name)}
+    if model is Casting:
+        return {'movie': Lookup('movie_id', Movie.title)}
+    return {}
+
+
+def csv_value(parse, value):
+    # csv only has strings, turn them into what the json parsers expect
+    if parse is parse_id:
+        return int(value)
+    if parse is parse_flag:
+        flag = value.strip().lower()
+        if flag not in ('1', '0', 'true', 'false', 'y', 'n', 'yes', 'no'):
+            raise ValueError(value)
+        return flag in ('1', 'true', 'y', 'yes')
+    return value
+
+
+def natural_keys(model):
+    # {foreign key: csv column it can be resolved from}
+    return {lookup.target: source
+            for source, lookup in lookups(model).items()}
+
+
+def check_header(model, header):
+    sources = natural_keys(model)
+    for name, value_input in model.inputs().items():
+        if name in header or sources.get(name, None) in header:
+            continue
+        if value_input.required:
+            raise click.UsageError(f'the csv has no {name} column')
+
+
+def parse_record(model, record):
+    # the column values of one csv record, or a ValueError naming the
+    # problem. natural keys are kept under their csv column until resolved
+    sources = natural_keys(model)
+    row = {}
+    for name, value_input in model.inputs().items():
+        value = record.get(name, None) or None
+        source = sources.get(name, None)
+        if value is None and source is not None and record.get(source):
+            row[source] = record[source]
+        elif value is None:
+            if value_input.required:
+                raise ValueError(f'missing {source or name}')
+            row[name] = value_input.default
+        else:
+            try:
+                row[name] = value_input.parse(
+                    csv_value(value_input.parse, value))
+            except (ValueError, TypeError, OverflowError):
+                raise ValueError(f'invalid {name}')
+    return row
+
+
+def resolve(model, rows, errors):
+    # one query per natural key column for the whole batch
+    session = get_db().session
+    for source, lookup in lookups(model).items():
+        keys = {row[source] for row in rows.values() if source in row}
+        if len(keys) == 0:
+            continue
+        target_model = lookup.column.class_
+        ids = dict(session.query(lookup.column, target_model.id)
+                   .filter(lookup.column.in_(keys)))
+        for index, row in list(rows.items()):
+            key = row.pop(source, None)
+            if key is None:
+                continue
+            if key not in ids:
+                errors[index] = f'unknown {source}'
+                del rows[index]
+            else:
+                row[lookup.target] = ids[key]
+
+
+class Loader():
+    # writes batches of validated rows to the model's table. on postgresql
+    # they are copied into a temporary staging table and merged from there
+    # with a single insert, elsewhere they are inserted with executemany
+    def __init__(self, model) -> None:
+        self.model = model
+        self.table = model.__table__
+        self.columns = list(model.inputs())
+        self.staging = f'import_{self.table.name}'
+        self.session = get_db().session
+        self.copy = get_db().engine.dialect.name == 'postgresql'
+        if self.copy:
+            columns = ', '.join(self.columns)
+            self.session.execute(text(
+                f'CREATE TEMP TABLE {self.staging} ON COMMIT DROP AS '
+                f'SELECT {columns} FROM {self.table.name} WITH NO DATA'))
+
+    def load(self, rows):
+        if len(rows) == 0:
+            return
+        if not self.copy:
+            self.session.execute(self.table.insert(), rows)
+            return
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([row[name] for name in self.columns])
+        buffer.seek(0)
+        columns = ', '.join(self.columns)
+        cursor = self.session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                f'COPY {self.staging} ({columns}) FROM STDIN '
+                f'WITH (FORMAT csv)', buffer)
+        finally:
+            cursor.close()
+        self.session.execute(text(
+            f'INSERT INTO {self.table.name} ({columns}) '
+            f'SELECT {columns} FROM {self.staging}'))
+        self.session.execute(text(f'TRUNCATE {self.staging}'))
+
+
+def import_csv(model, source, batch_size=IMPORT_BATCH, progress=None):
+    # reads the csv a batch at a time, so memory stays bounded by the batch
+    # size whatever the size of the file, and loads the valid records in a
+    # single transaction. rejected records are counted, the first
+    # ERROR_SAMPLES of them are reported with their line and reason
+    reader = csv.DictReader(source)
+    check_header(model, reader.fieldnames or [])
+    session = get_db().session
+    stats = {'rows': 0, 'imported': 0, 'rejected': 0, 'errors': []}
+    started = time.monotonic()
+    success = False
+    try:
+        loader = Loader(model)
+        batch = {}
+        for record in reader:
+            batch[reader.line_num] = record
+            if len(batch) >= batch_size:
+                import_batch(model, loader, batch, stats)
+                batch = {}
+                report(stats, started, progress)
+        import_batch(model, loader, batch, stats)
+        if stats['imported']:
+            written(model)
+        session.commit()
+        success = True
+    finally:
+        if not success:
+            session.rollback()
+        session.close()
+    return report(stats, started, progress)
+
+
+def import_batch(model, loader, batch, stats):
+    rows = {}
+    errors = {}
+    for line, record in batch.items():
+        try:
+            rows[line] = parse_record(model, record)
+        except ValueError as error:
+            errors[line] = str(error)
+    resolve(model, rows, errors)
+    check_references(model, rows, errors)
+    check_unique_keys(model, rows, errors)
+    loader.load([rows[line] for line in sorted(rows)])
+    stats['rows'] += len(batch)
+    stats['imported'] += len(rows)
+    stats['rejected'] += len(errors)
+    for line in sorted(errors):
+        if len(stats['errors']) >= ERROR_SAMPLES:
+            break
+        stats['errors'].append({'line': line, 'message': errors[line]})
+
+
+def report(stats, started, progress):
+    stats['seconds'] = time.monotonic() - started
+    stats['rows_per_second'] = stats['rows'] / max(stats['seconds'], 1e-9)
+    if progress is not None:
+        progress(stats)
+    return stats
+
+
+@click.command('import-csv')
+@click.argument('collection', type=click.Choice(sorted(IMPORTS)))
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--batch-size', default=IMPORT_BATCH, show_default=True,
+              type=click.IntRange(min=1))
+@with_appcontext
+def import_csv_command(collection, source, batch_size):
+    """Import a csv file (or - for stdin) into a collection."""
+    def progress(stats):
+        click.echo(f'{collection}: {stats["rows"]} rows read, '
+                   f'{stats["imported"]} imported, '
+                   f'{stats["rejected"]} rejected, '
+                   f'{stats["rows_per_second"]:.0f} rows/s', err=True)
+
+    stats = import_csv(IMPORTS[collection], source, batch_size, progress)
+    for error in stats['errors']:
+        click.echo(f'line {error["line"]}: {error["message"]}', err=True)
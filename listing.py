@@ -0,0 +1,238 @@
+import os
+import json
+import base64
+from flask import request, abort, Response, stream_with_context
+from flask import json as flask_json
+from datetime import datetime
+from sqlalchemy import tuple_
+from models import get_db
+from generations import generations, tables
+from row_cache import row_cache
+
+PAGE_LIMIT = int(os.getenv('PAGE_LIMIT', 100))
+MAX_PAGE_LIMIT = int(os.getenv('MAX_PAGE_LIMIT', 1000))
+EXPORT_BATCH = int(os.getenv('EXPORT_BATCH', 1000))
+
+
+def encode_cursor(values):
+    data = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except ValueError:
+        abort(400)
+    if not isinstance(values, list) or len(values) == 0:
+        abort(400)
+    return values
+
+
+def page_limit():
+    limit = request.args.get('limit', PAGE_LIMIT)
+    try:
+        limit = int(limit)
+    except ValueError:
+        abort(400)
+    if limit < 1 or limit > MAX_PAGE_LIMIT:
+        abort(400)
+    return limit
+
+
+def sorting(model):
+    # ?sort=column or ?sort=-column for descending order, restricted to
+    # the columns the model allows sorting on
+    spec = request.args.get('sort', 'id')
+    key = spec[1:] if spec.startswith('-') else spec
+    sorts = model.sorts()
+    if key not in sorts:
+        abort(400)
+    return spec, sorts[key], spec.startswith('-')
+
+
+def filtering(model, query):
+    for name, column_filter in model.filters().items():
+        value = request.args.get(name, None)
+        if value is None:
+            continue
+        try:
+            query = query.filter(column_filter.clause(value))
+        except (ValueError, OverflowError):
+            abort(400)
+    return query
+
+
+def encode_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def decode_value(column, value):
+    python_type = column.type.python_type
+    if python_type is datetime and isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            abort(400)
+    if not isinstance(value, python_type) or isinstance(value, bool):
+        abort(400)
+    return value
+
+
+def cursor_position(model, spec, column):
+    # the sort value and id of the last row of the previous page
+    cursor = request.args.get('cursor', None)
+    if cursor is None:
+        return None
+    values = decode_cursor(cursor)
+    if len(values) != 3 or values[0] != spec:
+        abort(400)
+    return decode_value(column, values[1]), decode_value(model.id, values[2])
+
+
+def paginate(query, model, sort=None):
+    # keyset pagination on (sort column, id): every page is an index range
+    # scan starting after the last row of the previous page, so deep pages
+    # cost the same as the first one and the order is stable across pages
+    spec, column, descending = sort if sort is not None else sorting(model)
+    limit = page_limit()
+    if descending:
+        query = query.order_by(column.desc(), model.id.desc())
+    else:
+        query = query.order_by(column, model.id)
+    last = cursor_position(model, spec, column)
+    if last is not None:
+        last_value, last_id = last
+        position = tuple_(column, model.id)
+        if descending:
+            query = query.filter(position < tuple_(last_value, last_id))
+        else:
+            query = query.filter(position > tuple_(last_value, last_id))
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(
+            [spec, encode_value(getattr(last, column.key)), last.id])
+    return rows, next_cursor
+
+
+def fieldset(model):
+    # the fields requested with ?fields=, None when all of them are
+    names = request.args.get('fields', None)
+    if names is None:
+        return None
+    names = [name.strip() for name in names.split(',') if name.strip()]
+    fields = model.fields()
+    if len(names) == 0 or any(name not in fields for name in names):
+        abort(400)
+    return list(dict.fromkeys(names))
+
+
+def project(model, names, extra_columns=()):
+    # selects only the columns behind the requested fields (and the id,
+    # which pagination needs), joining only the tables they come from
+    fields = model.fields()
+    columns = [model.id.label('id')]
+    joins = {}
+    for name in names:
+        if name == 'id':
+            continue
+        columns.append(fields[name].column.label(name))
+        joins.update(fields[name].joins)
+    for column in extra_columns:
+        if column.key not in names and column.key != 'id':
+            columns.append(column.label(column.key))
+    query = get_db().session.query(*columns).select_from(model)
+    for target, onclause in joins.items():
+        query = query.join(target, onclause)
+    return query
+
+
+def format_row(fields, names, row):
+    return {name: fields[name].convert(getattr(row, name)) for name in names}
+
+
+def listing_query(model, extra_columns=()):
+    # the query for a collection or record and the function formatting
+    # its rows, honouring ?fields=
+    names = fieldset(model)
+    if names is None:
+        return model.format_query(), lambda row: row.format()
+    query = project(model, names, extra_columns)
+    fields = model.fields()
+    return query, lambda row: format_row(fields, names, row)
+
+
+def page(model):
+    sort = sorting(model)
+    query, formatter = listing_query(model, extra_columns=[sort[1]])
+    rows, next_cursor = paginate(filtering(model, query), model, sort)
+    return [formatter(row) for row in rows], next_cursor
+
+
+def page_records(model, records):
+    # the page page(model) would return, cut from formatted records already
+    # held in memory, such as a lookup table's
+    spec, column, descending = sorting(model)
+    limit = page_limit()
+    names = fieldset(model)
+
+    def position(record):
+        return record[column.key], record['id']
+
+    records = sorted(records, key=position, reverse=descending)
+    last = cursor_position(model, spec, column)
+    if last is not None:
+        records = [record for record in records if
+                   (position(record) < last if descending else
+                    position(record) > last)]
+    next_cursor = None
+    if len(records) > limit:
+        records = records[:limit]
+        next_cursor = encode_cursor(
+            [spec, encode_value(records[-1][column.key]), records[-1]['id']])
+    if names is not None:
+        records = [{name: record[name] for name in names}
+                   for record in records]
+    return records, next_cursor
+
+
+def detail(model, record_id):
+    # the formatted record, None when there is none. whole records, and the
+    # ids without one, are kept in the row cache, ?fields= picks from them.
+    # the generations are taken before reading, a write committed in
+    # between only makes the next request read again
+    names = fieldset(model)
+    read_from = tables(model)
+    generation = generations.get(read_from)
+    cached, record = row_cache.get(model, record_id, generation)
+    if not cached:
+        version = row_cache.current()
+        row = model.format_query().filter(
+            model.id == record_id).one_or_none()
+        record = None if row is None else row.format()
+        row_cache.put(model, record_id, record, read_from, generation,
+                      version)
+    if record is None or names is None:
+        return record
+    return {name: record[name] for name in names}
+
+
+def export(model):
+    # streams every row as newline delimited json. rows are read from a
+    # server side cursor EXPORT_BATCH at a time, so memory stays flat and
+    # the first line is sent before the whole table has been read
+    query, formatter = listing_query(model)
+    query = filtering(model, query).order_by(model.id)
+
+    def generate():
+        for row in query.yield_per(EXPORT_BATCH):
+            yield flask_json.dumps(formatter(row)) + '\n'
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson')
@@ -0,0 +1,30 @@
+from flask import Blueprint
+from flask import jsonify
+from auth import requires_auth, jwks_store, token_cache
+from models import get_db, gender_names
+from generations import generations
+from response_cache import response_cache
+from notifications import listener
+from row_cache import row_cache
+from unit_of_work import checkout_stats
+
+metrics_blueprint = Blueprint('metrics_blueprint', __name__)
+
+
+@metrics_blueprint.route('/metrics', methods=['GET'])
+@requires_auth(permission='get:metrics')
+def get_metrics():
+    pool = get_db().engine.pool
+    return jsonify({
+        'success': True,
+        'pool': pool.stats() if hasattr(pool, 'stats') else None,
+        'requests': checkout_stats.stats(),
+        'jwks': jwks_store.stats(),
+        'tokens': token_cache.stats(),
+        'responses': response_cache.stats(),
+        'rows': row_cache.stats(),
+        'notifications': listener.stats(),
+        'lookups': {'genders': gender_names.stats()},
+        'generations': generations.stats(
+            sorted(get_db().metadata.tables))
+    })
@@ -0,0 +1,42 @@
+"""Foreign key and date indexes
+
+Revision ID: 4b1e9d2c7a53
+Revises: df7400c36888
+Create Date: 2026-10-18 09:12:41.532904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b1e9d2c7a53'
+down_revision = 'df7400c36888'
+branch_labels = None
+depends_on = None
+
+# casting.actor_id needs no index of its own, it leads UX_actor_movie_date.
+# the date indexes end with id so they also serve the (date, id) keyset
+# pagination used when sorting on the date.
+INDEXES = [
+    ('ix_casting_movie_id', 'casting', ['movie_id']),
+    ('ix_casting_casting_date', 'casting', ['casting_date', 'id']),
+    ('ix_actor_gender_id', 'actor', ['gender_id']),
+    ('ix_movie_release_date', 'movie', ['release_date', 'id']),
+]
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY does not block writes on postgres but
+    # cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns,
+                            postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table,
+                          postgresql_concurrently=True)
@@ -0,0 +1,29 @@
+"""Actor dob index
+
+Revision ID: 8e2f4a6b1c90
+Revises: 4b1e9d2c7a53
+Create Date: 2026-10-18 11:03:17.206115
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e2f4a6b1c90'
+down_revision = '4b1e9d2c7a53'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # serves the min_age and max_age dob ranges and sorting on dob
+    with op.get_context().autocommit_block():
+        op.create_index('ix_actor_dob', 'actor', ['dob', 'id'],
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_actor_dob', table_name='actor',
+                      postgresql_concurrently=True)
@@ -0,0 +1,71 @@
+"""Write notifications
+
+Revision ID: c3d5f7a9e1b2
+Revises: 8e2f4a6b1c90
+Create Date: 2026-10-18 20:12:41.532907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3d5f7a9e1b2'
+down_revision = '8e2f4a6b1c90'
+branch_labels = None
+depends_on = None
+
+TABLES = ['movie', 'gender', 'actor', 'casting']
+# the channel the api listens on, see notifications.py
+CHANNEL = 'casting_api_writes'
+
+
+def upgrade():
+    # every statement changing rows of a table sends the table's name to
+    # the listening workers when its transaction commits, whether it came
+    # from the api or not. the name follows the application_name of the
+    # writing connection, which the api sets to the origin of its
+    # generation counters (see generations.py). the truncate triggers have
+    # no transition table, changed is only read by the others
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('''
+        CREATE OR REPLACE FUNCTION notify_write() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                PERFORM pg_notify(TG_ARGV[0], current_setting(
+                    'application_name') || ':' || TG_TABLE_NAME);
+            ELSIF EXISTS (SELECT 1 FROM changed) THEN
+                PERFORM pg_notify(TG_ARGV[0], current_setting(
+                    'application_name') || ':' || TG_TABLE_NAME);
+            END IF;
+            RETURN NULL;
+        END
+        $$
+    ''')
+    for table in TABLES:
+        for operation, rows in [('INSERT', 'NEW'), ('UPDATE', 'NEW'),
+                                ('DELETE', 'OLD')]:
+            op.execute(f'''
+                CREATE TRIGGER {table}_{operation.lower()}_notify
+                AFTER {operation} ON {table}
+                REFERENCING {rows} TABLE AS changed
+                FOR EACH STATEMENT
+                EXECUTE PROCEDURE notify_write('{CHANNEL}')
+            ''')
+        op.execute(f'''
+            CREATE TRIGGER {table}_truncate_notify
+            AFTER TRUNCATE ON {table}
+            FOR EACH STATEMENT
+            EXECUTE PROCEDURE notify_write('{CHANNEL}')
+        ''')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in TABLES:
+        for operation in ['insert', 'update', 'delete', 'truncate']:
+            op.execute(f'DROP TRIGGER {table}_{operation}_notify ON {table}')
+    op.execute('DROP FUNCTION notify_write()')
@@ -1,13 +1,23 @@
+from flask import g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from datetime import datetime
+from sqlalchemy.orm import joinedload
+from datetime import datetime, date, time, timedelta
 from dateutil.relativedelta import relativedelta
+from dateutil.parser import isoparse
+from sqlalchemy.exc import SQLAlchemyError
+from db_pool import engine_options
+import logging
+import threading
+import operator
 import os
 
 db = SQLAlchemy()
 migrate = Migrate()
 
-live_db_url = os.getenv('DATABASE_URL')
+logger = logging.getLogger(__name__)
+
+live_db_url = os.getenv('DATABASE_URL', '')
 if len(live_db_url) == 0:
     db_name = os.getenv('DATABASE_NAME')
     test_db_name = os.getenv('TEST_DATABASE_NAME')
@@ -28,24 +38,160 @@ def setup_db(app, test_mode=False):
         else:
             db_path = db_url
     else:
-        db_path = live_db_url.replace('postgres', 'postgresql')
+        db_path = live_db_url
+        if db_path.startswith('postgres://'):
+            db_path = 'postgresql://' + db_path[len('postgres://'):]
     app.config["SQLALCHEMY_DATABASE_URI"] = db_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options()
     db.app = app
     db.init_app(app)
-    migrate = Migrate(app, db)
+    migrate.init_app(app, db)
 
 
 def get_db():
     return db
 
 
+def reference_date():
+    # one reference date per request, so every age in a response agrees
+    # and the date is not looked up again for every actor
+    if not has_request_context():
+        return date.today()
+    if 'today' not in g:
+        g.today = date.today()
+    return g.today
+
+
+def age_from_dob(dob, today=None):
+    today = reference_date() if today is None else today
+    birthday_ahead = (today.month, today.day) < (dob.month, dob.day)
+    return today.year - dob.year - int(birthday_ahead)
+
+
+def dob_bound(years):
+    # start of the day after the latest birth date of someone who turns
+    # `years` old on the reference date
+    born = reference_date() - relativedelta(years=years)
+    return datetime.combine(born, time()) + timedelta(days=1)
+
+
+def at_least(column, years):
+    return column < dob_bound(years)
+
+
+def at_most(column, years):
+    return column >= dob_bound(years + 1)
+
+
+def recast_flag(recast_yn):
+    if recast_yn:
+        return 'Y'
+    else:
+        return 'N'
+
+
+def parse_datetime(value):
+    if not isinstance(value, str):
+        raise ValueError('expected a date')
+    parsed = isoparse(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.replace(tzinfo=None) - parsed.utcoffset()
+    return parsed
+
+
+def parse_text(value):
+    if not isinstance(value, str) or len(value.strip()) == 0:
+        raise ValueError('expected a non-empty string')
+    return value
+
+
+def parse_id(value):
+    if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+        raise ValueError('expected an id')
+    return value
+
+
+def parse_flag(value):
+    if not isinstance(value, (bool, int)) or value not in (0, 1):
+        raise ValueError('expected a boolean')
+    return bool(value)
+
+
+class Filter():
+    # a query string filter: the column it restricts, the comparison
+    # applied, how the query string value is parsed and whether what it
+    # matches depends on the reference date
+    def __init__(self, column, compare=operator.eq, parse=int, dated=False):
+        self.column = column
+        self.compare = compare
+        self.parse = parse
+        self.dated = dated
+
+    def clause(self, value):
+        return self.compare(self.column, self.parse(value))
+
+
+class Field():
+    # a field of the formatted output: the column it is read from, the
+    # tables that column needs joined in ({model: onclause}), how the
+    # raw value is turned into the formatted one, the models whose
+    # lookup tables that reads and whether it depends on the reference date
+    def __init__(self, column, joins=None, convert=None, lookups=None,
+                 dated=False):
+        self.column = column
+        self.joins = joins if joins is not None else {}
+        self.convert = convert if convert is not None else (lambda v: v)
+        self.lookups = lookups if lookups is not None else []
+        self.dated = dated
+
+
+class Input():
+    # a value accepted when records are created in bulk: how it is parsed,
+    # the model it refers to, if any, and its default when it is optional
+    def __init__(self, parse, references=None, required=True, default=None):
+        self.parse = parse
+        self.references = references
+        self.required = required
+        self.default = default
+
+
 def get_migrate():
     return migrate
 
 
 class CastModel():
 
+    @classmethod
+    def format_query(cls):
+        # query loading everything format() reads, in a single statement
+        return cls.query
+
+    @classmethod
+    def fields(cls):
+        # the fields of format(), selectable one by one with ?fields=
+        return {}
+
+    @classmethod
+    def filters(cls):
+        # the query string filters the collection accepts
+        return {}
+
+    @classmethod
+    def sorts(cls):
+        # the columns the collection can be sorted on with ?sort=
+        return {'id': cls.id}
+
+    @classmethod
+    def inputs(cls):
+        # the values a record is created from by the batch routes
+        return {}
+
+    @classmethod
+    def unique_keys(cls):
+        # the column sets no two records may share
+        return []
+
     def insert(self):
         db.session.add(self)
         self.apply()
@@ -72,6 +218,9 @@ class CastModel():
 
 class Movie(db.Model, CastModel):
     __tablename__ = 'movie'
+    __table_args__ = (
+        db.Index('ix_movie_release_date', 'release_date', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(), nullable=False, unique=True)
     release_date = db.Column(db.DateTime, nullable=False)
@@ -82,6 +231,42 @@ class Movie(db.Model, CastModel):
         self.title = title
         self.release_date = release_date
 
+    @classmethod
+    def fields(cls):
+        return {
+            'id': Field(cls.id),
+            'title': Field(cls.title),
+            'release_date': Field(cls.release_date)
+        }
+
+    @classmethod
+    def filters(cls):
+        return {
+            'released_after': Filter(cls.release_date, operator.gt,
+                                     parse_datetime),
+            'released_before': Filter(cls.release_date, operator.lt,
+                                      parse_datetime)
+        }
+
+    @classmethod
+    def sorts(cls):
+        return {
+            'id': cls.id,
+            'title': cls.title,
+            'release_date': cls.release_date
+        }
+
+    @classmethod
+    def inputs(cls):
+        return {
+            'title': Input(parse_text),
+            'release_date': Input(parse_datetime)
+        }
+
+    @classmethod
+    def unique_keys(cls):
+        return [('title',)]
+
     def format(self):
         return {
             'id': self.id,
@@ -92,11 +277,14 @@ class Movie(db.Model, CastModel):
 
 class Actor(db.Model, CastModel):
     __tablename__ = 'actor'
+    __table_args__ = (
+        db.Index('ix_actor_dob', 'dob', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(), nullable=False)
     dob = db.Column(db.DateTime, nullable=False)
     gender_id = db.Column(db.Integer, db.ForeignKey(
-        'gender.id'), nullable=False)
+        'gender.id'), nullable=False, index=True)
     castings = db.relationship('Casting', backref='actor', lazy=True)
 
     def __init__(self, name, dob, gender_id) -> None:
@@ -105,11 +293,45 @@ class Actor(db.Model, CastModel):
         self.dob = dob
         self.gender_id = gender_id
 
+    @classmethod
+    def fields(cls):
+        # gender names come from the gender lookup table, not a join
+        return {
+            'id': Field(cls.id),
+            'name': Field(cls.name),
+            'dob': Field(cls.dob),
+            'age': Field(cls.dob, convert=age_from_dob, dated=True),
+            'gender': Field(cls.gender_id, convert=gender_name,
+                            lookups=[Gender])
+        }
+
+    @classmethod
+    def filters(cls):
+        # age bands become dob ranges, which can use ix_actor_dob
+        return {
+            'gender_id': Filter(cls.gender_id),
+            'min_age': Filter(cls.dob, at_least, dated=True),
+            'max_age': Filter(cls.dob, at_most, dated=True)
+        }
+
+    @classmethod
+    def sorts(cls):
+        return {
+            'id': cls.id,
+            'name': cls.name,
+            'dob': cls.dob
+        }
+
+    @classmethod
+    def inputs(cls):
+        return {
+            'name': Input(parse_text),
+            'dob': Input(parse_datetime),
+            'gender_id': Input(parse_id, references=Gender)
+        }
+
     def age(self):
-        now = datetime.now()
-        today = now.date()
-        age = relativedelta(today, self.dob).years
-        return age
+        return age_from_dob(self.dob)
 
     def in_format(self):
         return {
@@ -125,7 +347,7 @@ class Actor(db.Model, CastModel):
             'name': self.name,
             'dob': self.dob,
             'age': self.age(),
-            'gender': self.gender.name
+            'gender': gender_name(self.gender_id)
         }
 
 
@@ -139,6 +361,30 @@ class Gender(db.Model, CastModel):
         super().__init__()
         self.name = name
 
+    @classmethod
+    def fields(cls):
+        return {
+            'id': Field(cls.id),
+            'name': Field(cls.name)
+        }
+
+    @classmethod
+    def sorts(cls):
+        return {
+            'id': cls.id,
+            'name': cls.name
+        }
+
+    @classmethod
+    def inputs(cls):
+        return {
+            'name': Input(parse_text)
+        }
+
+    @classmethod
+    def unique_keys(cls):
+        return [('name',)]
+
     def format(self):
         return {
             'id': self.id,
@@ -148,9 +394,13 @@ class Gender(db.Model, CastModel):
 
 class Casting(db.Model, CastModel):
     __tablename__ = 'casting'
+    __table_args__ = (
+        db.Index('ix_casting_casting_date', 'casting_date', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     actor_id = db.Column(db.Integer, db.ForeignKey('actor.id'), nullable=False)
-    movie_id = db.Column(db.Integer, db.ForeignKey('movie.id'), nullable=False)
+    movie_id = db.Column(db.Integer, db.ForeignKey('movie.id'),
+                         nullable=False, index=True)
     casting_date = db.Column(db.DateTime, nullable=False)
     recast_yn = db.Column(db.Boolean, nullable=False)
     db.UniqueConstraint(actor_id, movie_id, casting_date,
@@ -168,11 +418,53 @@ class Casting(db.Model, CastModel):
         self.casting_date = casting_date
         self.recast_yn = recast_yn
 
+    @classmethod
+    def format_query(cls):
+        return cls.query.options(joinedload(cls.actor), joinedload(cls.movie))
+
+    @classmethod
+    def fields(cls):
+        return {
+            'id': Field(cls.id),
+            'actor': Field(Actor.name,
+                           joins={Actor: Actor.id == cls.actor_id}),
+            'movie': Field(Movie.title,
+                           joins={Movie: Movie.id == cls.movie_id}),
+            'casting_date': Field(cls.casting_date),
+            'recast_yn': Field(cls.recast_yn, convert=recast_flag)
+        }
+
+    @classmethod
+    def filters(cls):
+        return {
+            'actor_id': Filter(cls.actor_id),
+            'movie_id': Filter(cls.movie_id),
+            'from': Filter(cls.casting_date, operator.ge, parse_datetime),
+            'to': Filter(cls.casting_date, operator.le, parse_datetime)
+        }
+
+    @classmethod
+    def sorts(cls):
+        return {
+            'id': cls.id,
+            'casting_date': cls.casting_date
+        }
+
+    @classmethod
+    def inputs(cls):
+        return {
+            'actor_id': Input(parse_id, references=Actor),
+            'movie_id': Input(parse_id, references=Movie),
+            'casting_date': Input(parse_datetime),
+            'recast_yn': Input(parse_flag, required=False, default=False)
+        }
+
+    @classmethod
+    def unique_keys(cls):
+        return [('actor_id', 'movie_id', 'casting_date')]
+
     def recast(self):
-        if self.recast_yn:
-            return 'Y'
-        else:
-            return 'N'
+        return recast_flag(self.recast_yn)
 
     def in_format(self):
         return {
@@ -191,3 +483,99 @@ class Casting(db.Model, CastModel):
             'casting_date': self.casting_date,
             'recast_yn': self.recast()
         }
+
+
+class LookupTable():
+    # every record of a small, rarely written table, formatted and held by
+    # id in the process. it is loaded at startup, before the workers are
+    # forked, and again on the first use after a write to the table, or
+    # when asked for an id it does not know yet. the records are kept with
+    # the table's generation (see generations), and a request finding
+    # another generation, because a process that did not tell us wrote the
+    # table, loads them again. a request sees the same records throughout
+    def __init__(self, model) -> None:
+        self.model = model
+        self.lock = threading.Lock()
+        self.records = None
+        self.generation = None
+        self.version = 0
+        # returns the table's current generation, set by generations
+        self.current = lambda: None
+        self.counters = {
+            'hits': 0,
+            'loads': 0
+        }
+
+    def load(self):
+        with self.lock:
+            version = self.version
+        generation = self.current()
+        fields = self.model.fields()
+        query = db.session.query(*[field.column.label(name)
+                                   for name, field in fields.items()])
+        records = {row.id: {name: field.convert(getattr(row, name))
+                            for name, field in fields.items()}
+                   for row in query}
+        with self.lock:
+            self.counters['loads'] += 1
+            if self.version == version:
+                self.records = records
+                self.generation = generation
+        if has_request_context():
+            g.setdefault('lookups', {})[self.model] = records
+        return records
+
+    def all(self):
+        if has_request_context() and self.model in g.get('lookups', {}):
+            return g.lookups[self.model]
+        with self.lock:
+            records = self.records
+            fresh = records is not None and \
+                self.generation == self.current()
+            if fresh:
+                self.counters['hits'] += 1
+        if not fresh:
+            return self.load()
+        if has_request_context():
+            g.setdefault('lookups', {})[self.model] = records
+        return records
+
+    def get(self, record_id):
+        records = self.all()
+        if record_id not in records:
+            records = self.load()
+        return records.get(record_id, None)
+
+    def invalidate(self, names):
+        if self.model.__tablename__ in names:
+            with self.lock:
+                self.version += 1
+                self.records = None
+
+    def stats(self):
+        records = self.records
+        return {
+            **self.counters,
+            'records': None if records is None else len(records)
+        }
+
+
+gender_names = LookupTable(Gender)
+
+
+def gender_name(gender_id):
+    gender = gender_names.get(gender_id)
+    return None if gender is None else gender['name']
+
+
+def load_lookups(app):
+    # fills the lookup tables when the app starts, a database that is not
+    # there yet, not migrated or not configured leaves them to be loaded on
+    # first use
+    with app.app_context():
+        try:
+            gender_names.load()
+        except (SQLAlchemyError, ValueError) as error:
+            logger.warning('lookup tables not loaded: %s', error)
+        finally:
+            db.session.remove()
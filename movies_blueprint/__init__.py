@@ -2,39 +2,50 @@ from flask import Blueprint
 from models import Movie
 from flask import request, abort, jsonify
 from auth import requires_auth
+from generations import conditional
+from listing import page, detail, export
+from writes import insert_record, update_record, delete_record, supplied
+from bulk import create_batch, sync_batch
 
 movies_blueprint = Blueprint('movies_blueprint', __name__)
 
 
 @movies_blueprint.route('/movies', methods=['GET'])
 @requires_auth(permission='get:movies')
+@conditional(Movie)
 def get_movies():
-    movies = Movie.query.all()
-    format_movies = [movie.format() for movie in movies]
+    format_movies, next_cursor = page(Movie)
     return jsonify({
         'success': True,
-        'movies': format_movies
+        'movies': format_movies,
+        'next': next_cursor
     })
 
 
+@movies_blueprint.route('/movies/export', methods=['GET'])
+@requires_auth(permission='get:movies')
+@conditional(Movie)
+def export_movies():
+    return export(Movie)
+
+
 @movies_blueprint.route('/movies/<int:movie_id>', methods=['GET'])
 @requires_auth(permission='get:movies')
+@conditional(Movie)
 def get_movie(movie_id):
-    movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
-    if movie is None:
+    format_movie = detail(Movie, movie_id)
+    if format_movie is None:
         abort(404)
     else:
-        format_movies = [movie.format()]
         return jsonify({
             'success': True,
-            'movies': format_movies
+            'movies': [format_movie]
         })
 
 
 @movies_blueprint.route('/movies', methods=['POST'])
 @requires_auth(permission='post:movies')
 def create_movie():
-    success = False
     body = request.get_json()
     if body is None:
         abort(400)
@@ -45,90 +56,57 @@ def create_movie():
         if check:
             abort(400)
         else:
-            movie = Movie(title=title, release_date=release_date)
-            try:
-                movie.insert()
-                movie.apply()
-                movie.refresh()
-                format_movies = [movie.format()]
-                success = True
-            finally:
-                if success:
-                    movie.dispose()
-                    return jsonify({
-                        'success': success,
-                        'created': movie.id,
-                        'movies': format_movies
-                    })
-                else:
-                    movie.rollback()
-                    movie.dispose()
-                    abort(422)
+            format_movie = insert_record(Movie, {
+                'title': title, 'release_date': release_date})
+            return jsonify({
+                'success': True,
+                'created': format_movie['id'],
+                'movies': [format_movie]
+            })
+
+
+@movies_blueprint.route('/movies/batch', methods=['POST'])
+@requires_auth(permission='post:movies')
+def create_movies():
+    return create_batch(Movie)
+
+
+@movies_blueprint.route('/movies/sync', methods=['PUT'])
+@requires_auth(permission=['post:movies', 'patch:movies'])
+def sync_movies():
+    return sync_batch(Movie)
 
 
 @movies_blueprint.route('/movies/<int:movie_id>', methods=['PATCH'])
 @requires_auth(permission='patch:movies')
 def modify_movie(movie_id):
-    success = False
     body = request.get_json()
     if body is None:
         abort(400)
     else:
-        title = body.get('title', None)
-        release_date = body.get('release_date', None)
-        check = title is None or release_date is None or movie_id is None
-        if check:
+        values = supplied(body, ['title', 'release_date'])
+        if len(values) == 0:
             abort(400)
         else:
-            movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
-            if movie is None:
+            format_movie = update_record(Movie, movie_id, values)
+            if format_movie is None:
                 abort(404)
             else:
-                try:
-                    movie.title = title
-                    movie.release_date = release_date
-                    movie.update()
-                    movie.apply()
-                    format_movies = [movie.format()]
-                    success = True
-                finally:
-                    if success:
-                        movie.dispose()
-                        return jsonify({
-                            'success': success,
-                            'modified': movie_id,
-                            'movies': format_movies
-                        })
-                    else:
-                        movie.rollback()
-                        movie.dispose()
-                        abort(422)
+                return jsonify({
+                    'success': True,
+                    'modified': movie_id,
+                    'movies': [format_movie]
+                })
 
 
 @movies_blueprint.route('/movies/<int:movie_id>', methods=['DELETE'])
 @requires_auth(permission='delete:movies')
 def delete_movie(movie_id):
-    success = False
-    if movie_id is None:
-        abort(400)
+    if delete_record(Movie, movie_id) is None:
+        abort(404)
     else:
-        movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
-        if(movie is None):
-            abort(404)
-        else:
-            try:
-                movie.delete()
-                movie.apply()
-                success = True
-            finally:
-                if success:
-                    movie.dispose()
-                    return jsonify({
-                        'success': success,
-                        'deleted': movie_id,
-                        'movies': []
-                    })
-                else:
-                    movie.rollback()
-                    movie.dispose()
-                    abort(422)
+        return jsonify({
+            'success': True,
+            'deleted': movie_id,
+            'movies': []
+        })
@@ -0,0 +1,139 @@
+import os
+import select
+import logging
+import threading
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+from db_pool import NOTIFY_ENABLED
+from models import get_db
+from generations import generations
+
+# the channel the write triggers notify (see the write notifications
+# migration), with the origin of the writer and the name of the table
+# written as the payload
+NOTIFY_CHANNEL = 'casting_api_writes'
+# the longest a worker serves data another process has changed while it
+# cannot listen for notifications
+NOTIFY_MAX_STALENESS = float(os.getenv('NOTIFY_MAX_STALENESS', 30))
+
+logger = logging.getLogger(__name__)
+
+
+class Listener():
+    # a thread per worker holding its own connection, outside the pool, on
+    # which it LISTENs for the tables written by any process, this one
+    # included, and passes them on to the generations. while it cannot
+    # listen, every table is treated as changed every NOTIFY_MAX_STALENESS
+    # seconds, and once more when it is listening again, since the
+    # notifications sent meanwhile are lost
+    def __init__(self, channel=NOTIFY_CHANNEL,
+                 max_staleness=NOTIFY_MAX_STALENESS) -> None:
+        self.channel = channel
+        self.max_staleness = max_staleness
+        self.engine = None
+        self.names = []
+        self.pid = None
+        self.thread = None
+        self.listening = False
+        self.missed = False
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.counters = {
+            'notifications': 0,
+            'disconnects': 0,
+            'stale_invalidations': 0
+        }
+
+    def start(self, url, names):
+        # once per process, forked workers start their own
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.engine = create_engine(url, poolclass=NullPool)
+            self.names = names
+            self.listening = False
+            self.missed = False
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, daemon=True,
+                                           name='notifications')
+            self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.pid = None
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                self.listen()
+            except Exception as error:
+                logger.warning('not listening for notifications: %s', error)
+            if self.stopping.is_set():
+                break
+            if self.listening:
+                self.counters['disconnects'] += 1
+            self.listening = False
+            self.missed = True
+            self.invalidate_all()
+            self.stopping.wait(self.max_staleness)
+
+    def listen(self):
+        connection = self.engine.raw_connection()
+        try:
+            dbapi_connection = connection.connection
+            dbapi_connection.autocommit = True
+            cursor = dbapi_connection.cursor()
+            channel = self.channel.replace('"', '""')
+            cursor.execute(f'LISTEN "{channel}"')
+            self.listening = True
+            if self.missed:
+                self.missed = False
+                self.invalidate_all()
+            while not self.stopping.is_set():
+                ready = select.select([dbapi_connection], [], [],
+                                      self.max_staleness)[0]
+                if not ready:
+                    # a dead connection only shows when it is used
+                    cursor.execute('SELECT 1')
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    self.received(dbapi_connection.notifies.pop(0).payload)
+        finally:
+            connection.invalidate()
+
+    def received(self, payload):
+        # processes sharing our counters have bumped them on commit, only
+        # the caches of this process are left to drop
+        origin, _, name = payload.rpartition(':')
+        self.counters['notifications'] += 1
+        generations.changed([name], bump=origin != generations.origin())
+
+    def invalidate_all(self):
+        if self.names:
+            self.counters['stale_invalidations'] += 1
+            generations.changed(self.names)
+
+    def stats(self):
+        return {
+            **self.counters,
+            'listening': self.listening
+        }
+
+
+listener = Listener()
+
+
+def init_app(app):
+    # the listener starts with the first request of each worker, after
+    # gunicorn has forked it
+    @app.before_request
+    def start_listener():
+        if listener.pid == os.getpid() or not NOTIFY_ENABLED:
+            return
+        engine = get_db().engine
+        if engine.dialect.name == 'postgresql':
+            listener.start(engine.url, sorted(get_db().metadata.tables))
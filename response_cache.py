@@ -0,0 +1,101 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from flask import current_app
+
+# the bytes of response bodies a worker keeps, 0 turns the cache off
+RESPONSE_CACHE_BYTES = int(os.getenv('RESPONSE_CACHE_BYTES', 32 * 1024 * 1024))
+# larger responses are not kept, so one big page cannot push out many
+# small ones
+RESPONSE_CACHE_ENTRY_BYTES = int(os.getenv('RESPONSE_CACHE_ENTRY_BYTES',
+                                           RESPONSE_CACHE_BYTES // 16))
+# seconds a response is kept at most, whatever is written
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', 300))
+# allowance for the key, the tag and the bookkeeping of each entry
+ENTRY_OVERHEAD = 256
+
+
+class ResponseCache():
+    # lru cache of serialized GET responses keyed by path and query string,
+    # bounded by an approximate byte budget. an entry is only served while
+    # its tag is the current one (see generations), which for responses
+    # holding ages includes the date, and for RESPONSE_CACHE_TTL seconds at
+    # most. it is dropped as soon as this worker commits a write to one of
+    # the tables it was read from
+    def __init__(self, max_bytes=RESPONSE_CACHE_BYTES,
+                 max_entry_bytes=RESPONSE_CACHE_ENTRY_BYTES,
+                 ttl=RESPONSE_CACHE_TTL) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0
+        }
+
+    def get(self, key, etag):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[5] <= time.monotonic():
+                self.remove(key)
+                self.counters['expirations'] += 1
+                entry = None
+            if entry is None or entry[0] != etag:
+                self.counters['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counters['hits'] += 1
+        return current_app.response_class(entry[2], content_type=entry[3])
+
+    def put(self, key, etag, names, response):
+        if response.is_streamed:
+            return
+        body = response.get_data()
+        size = len(key) + len(body) + ENTRY_OVERHEAD
+        if size > self.max_entry_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (etag, frozenset(names), body,
+                                 response.content_type, size,
+                                 time.monotonic() + self.ttl)
+            self.size += size
+            while self.size > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.counters['evictions'] += 1
+
+    def remove(self, key):
+        entry = self.entries.pop(key)
+        self.size -= entry[4]
+
+    def invalidate(self, names):
+        # drops the responses read from any of the tables in names
+        with self.lock:
+            stale = [key for key, entry in self.entries.items()
+                     if not entry[1].isdisjoint(names)]
+            for key in stale:
+                self.remove(key)
+            self.counters['invalidations'] += len(stale)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        return {
+            **self.counters,
+            'entries': len(self.entries),
+            'bytes': self.size
+        }
+
+
+response_cache = ResponseCache()
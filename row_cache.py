@@ -0,0 +1,113 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+ROW_CACHE_SIZE = int(os.getenv('ROW_CACHE_SIZE', 10000))
+# seconds a formatted record is kept, and how long a missing id is
+# remembered as missing
+ROW_CACHE_TTL = float(os.getenv('ROW_CACHE_TTL', 60))
+ROW_CACHE_NEGATIVE_TTL = float(os.getenv('ROW_CACHE_NEGATIVE_TTL', 10))
+
+
+class RowCache():
+    # lru cache of formatted records keyed by table and id, including the
+    # ids that have no record, so repeated lookups of either reach the
+    # database once per ttl. an entry keeps the generations of the tables
+    # it was read from (see generations) and is only served while they are
+    # the current ones, so a write committed by another worker, that this
+    # one has not heard of, is never hidden by it. a commit writing one of
+    # those tables here drops it, and so does a patch or delete of the
+    # record itself. a read that was under way while an entry was dropped
+    # does not put its result back
+    def __init__(self, max_entries=ROW_CACHE_SIZE, ttl=ROW_CACHE_TTL,
+                 negative_ttl=ROW_CACHE_NEGATIVE_TTL) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict()
+        self.version = 0
+        self.lock = threading.Lock()
+        self.counters = {
+            'hits': 0,
+            'negative_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'stale': 0,
+            'invalidations': 0
+        }
+
+    def get(self, model, record_id, generation):
+        # whether the record is cached at generation, and the record (None
+        # when there is no record with that id)
+        key = (model.__tablename__, record_id)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] != generation:
+                del self.entries[key]
+                self.counters['stale'] += 1
+                entry = None
+            if entry is not None:
+                record, names, _, expires_at = entry
+                if expires_at > time.monotonic():
+                    self.entries.move_to_end(key)
+                    if record is None:
+                        self.counters['negative_hits'] += 1
+                    else:
+                        self.counters['hits'] += 1
+                    return True, record
+                del self.entries[key]
+                self.counters['expirations'] += 1
+            self.counters['misses'] += 1
+            return False, None
+
+    def current(self):
+        # taken before reading a record, and handed back to put
+        with self.lock:
+            return self.version
+
+    def put(self, model, record_id, record, names, generation, version):
+        if self.max_entries < 1:
+            return
+        ttl = self.negative_ttl if record is None else self.ttl
+        key = (model.__tablename__, record_id)
+        with self.lock:
+            if version != self.version:
+                return
+            self.entries[key] = (record, frozenset(names), generation,
+                                 time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def discard(self, model, record_id):
+        with self.lock:
+            self.version += 1
+            key = (model.__tablename__, record_id)
+            if self.entries.pop(key, None) is not None:
+                self.counters['invalidations'] += 1
+
+    def invalidate(self, names):
+        # drops the records read from any of the tables in names
+        with self.lock:
+            self.version += 1
+            stale = [key for key, entry in self.entries.items()
+                     if not entry[1].isdisjoint(names)]
+            for key in stale:
+                del self.entries[key]
+            self.counters['invalidations'] += len(stale)
+
+    def stats(self):
+        with self.lock:
+            hits = self.counters['hits'] + self.counters['negative_hits']
+            lookups = hits + self.counters['misses']
+            return {
+                **self.counters,
+                'entries': len(self.entries),
+                'hit_ratio': hits / lookups if lookups else None
+            }
+
+
+row_cache = RowCache()
@@ -0,0 +1,241 @@
+import os
+import mmap
+import time
+import struct
+import hashlib
+import logging
+import tempfile
+import threading
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# defaults to a file per user and deployment, see default_path
+SHARED_CACHE_PATH = os.getenv('SHARED_CACHE_PATH')
+SHARED_CACHE_SLOTS = int(os.getenv('SHARED_CACHE_SLOTS', 4096))
+SHARED_JWKS_BYTES = 64 * 1024
+
+MAGIC = b'CAST'
+VERSION = 3
+# magic, version, token slots, jwks length, jwks fetched at
+HEADER = struct.Struct('<4sIIId')
+# digest of the deployment the file was initialised for
+NAMESPACE = struct.Struct('<32s')
+HEADER_BYTES = 64
+# epoch of the generation counters, chosen when the file is initialised
+EPOCH = struct.Struct('<Q')
+# table name, generation
+GENERATION = struct.Struct('<32sQ')
+GENERATION_SLOTS = 32
+GENERATIONS_OFFSET = HEADER_BYTES + SHARED_JWKS_BYTES
+TOKENS_OFFSET = GENERATIONS_OFFSET + EPOCH.size + \
+    GENERATION_SLOTS * GENERATION.size
+# token digest, expires at
+SLOT = struct.Struct('<32sd')
+PROBES = 8
+EMPTY = bytes(32)
+
+logger = logging.getLogger(__name__)
+
+
+def namespace_digest(namespace):
+    return hashlib.blake2b(namespace.encode('utf-8'), digest_size=32).digest()
+
+
+def default_path(namespace):
+    # deployments sharing a user and a host, but not an issuer, an audience
+    # or a jwks url, must not trust each other's tokens and keys
+    name = namespace_digest(namespace).hex()[:16]
+    return os.path.join(tempfile.gettempdir(),
+                        f'casting-api-{os.getuid()}-{name}.cache')
+
+
+class SharedCache():
+    # a memory-mapped file shared by every worker process on the host.
+    # it holds the last jwks document that was fetched, the generation
+    # counters of the tables and a fixed size, open addressed table of
+    # verified token digests with their expiry.
+    # writers are serialised with a posix record lock on the file (which,
+    # unlike flock, is not shared with forked children) plus a thread lock.
+    # the file records the deployment it serves, and is not used by any
+    # other, nor shrunk under the processes that may have it mapped.
+    def __init__(self, path, slots=SHARED_CACHE_SLOTS, namespace=''):
+        self.path = path
+        self.slots = slots
+        self.namespace = namespace_digest(namespace)
+        self.size = TOKENS_OFFSET + slots * SLOT.size
+        self.lock = threading.Lock()
+        self.fd = None
+        self.map = None
+        self.attach()
+
+    @classmethod
+    def open(cls, path=SHARED_CACHE_PATH, slots=SHARED_CACHE_SLOTS,
+             namespace=''):
+        # returns None when the platform or the path does not allow a
+        # shared cache, callers then keep to their per-process caches.
+        # namespace names the deployment, tokens and keys are only shared
+        # within it
+        if path is None:
+            path = default_path(namespace)
+        if not path or fcntl is None:
+            return None
+        try:
+            return cls(path, slots, namespace)
+        except (OSError, ValueError) as error:
+            logger.warning('shared cache disabled: %s', error)
+            return None
+
+    def attach(self):
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0)
+        fd = os.open(self.path, flags, 0o600)
+        try:
+            info = os.fstat(fd)
+            if info.st_uid != os.geteuid() or info.st_mode & 0o077:
+                raise ValueError(f'{self.path} is not private to this user')
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            try:
+                # other processes may have the file mapped, it only grows
+                size = os.fstat(fd).st_size
+                if size > self.size:
+                    raise ValueError(f'{self.path} holds more slots than '
+                                     f'{self.slots}')
+                if size < self.size:
+                    os.ftruncate(fd, self.size)
+                shared_map = mmap.mmap(fd, self.size)
+                try:
+                    self.initialise(shared_map)
+                except Exception:
+                    shared_map.close()
+                    raise
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN)
+        except Exception:
+            os.close(fd)
+            raise
+        self.fd = fd
+        self.map = shared_map
+
+    def initialise(self, shared_map):
+        magic, version, slots = HEADER.unpack_from(shared_map)[:3]
+        namespace = NAMESPACE.unpack_from(shared_map, HEADER.size)[0]
+        if (magic, version, slots) == (MAGIC, VERSION, self.slots):
+            if namespace != self.namespace:
+                raise ValueError(f'{self.path} serves another deployment')
+            return
+        shared_map[:] = bytes(self.size)
+        HEADER.pack_into(shared_map, 0, MAGIC, VERSION, self.slots, 0, 0.0)
+        NAMESPACE.pack_into(shared_map, HEADER.size, self.namespace)
+        EPOCH.pack_into(shared_map, GENERATIONS_OFFSET,
+                        int.from_bytes(os.urandom(8), 'little'))
+
+    def locked(self, exclusive=True):
+        return FileLock(self, exclusive)
+
+    def get_jwks(self, newer_than=0.0, max_age=None):
+        with self.locked(exclusive=False):
+            length, fetched_at = HEADER.unpack_from(self.map)[3:]
+            if length == 0 or fetched_at <= newer_than:
+                return None
+            if max_age is not None and time.time() - fetched_at >= max_age:
+                return None
+            return bytes(self.map[HEADER_BYTES:HEADER_BYTES + length]), \
+                fetched_at
+
+    def put_jwks(self, document, fetched_at=None):
+        if len(document) > SHARED_JWKS_BYTES:
+            return False
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        with self.locked():
+            self.map[HEADER_BYTES:HEADER_BYTES + len(document)] = document
+            HEADER.pack_into(self.map, 0, MAGIC, VERSION, self.slots,
+                             len(document), fetched_at)
+        return True
+
+    def generation_offset(self, name, create=False):
+        # the slot of a table's counter, None when it has none yet
+        key = name.encode('utf-8')[:GENERATION.size - EPOCH.size]
+        key = key.ljust(GENERATION.size - EPOCH.size, b'\0')
+        base = GENERATIONS_OFFSET + EPOCH.size
+        for slot in range(GENERATION_SLOTS):
+            offset = base + slot * GENERATION.size
+            slot_key = GENERATION.unpack_from(self.map, offset)[0]
+            if slot_key == key:
+                return offset
+            if slot_key == EMPTY:
+                if create:
+                    GENERATION.pack_into(self.map, offset, key, 0)
+                    return offset
+                return None
+        raise ValueError('no generation slot left for ' + name)
+
+    def get_generations(self, names):
+        # the epoch and the generation of each table
+        with self.locked(exclusive=False):
+            epoch = EPOCH.unpack_from(self.map, GENERATIONS_OFFSET)[0]
+            generations = []
+            for name in names:
+                offset = self.generation_offset(name)
+                generations.append(0 if offset is None else
+                                   GENERATION.unpack_from(self.map,
+                                                          offset)[1])
+        return epoch, generations
+
+    def bump_generations(self, names):
+        with self.locked():
+            for name in names:
+                offset = self.generation_offset(name, create=True)
+                key, generation = GENERATION.unpack_from(self.map, offset)
+                GENERATION.pack_into(self.map, offset, key, generation + 1)
+
+    def slot_offsets(self, digest):
+        start = int.from_bytes(digest[:8], 'little') % self.slots
+        for probe in range(min(PROBES, self.slots)):
+            yield TOKENS_OFFSET + ((start + probe) % self.slots) * SLOT.size
+
+    def has_token(self, digest):
+        now = time.time()
+        with self.locked(exclusive=False):
+            for offset in self.slot_offsets(digest):
+                slot_digest, expires_at = SLOT.unpack_from(self.map, offset)
+                if slot_digest == digest:
+                    return expires_at > now
+        return False
+
+    def put_token(self, digest, expires_at):
+        now = time.time()
+        with self.locked():
+            target = None
+            for offset in self.slot_offsets(digest):
+                slot_digest, slot_expires = SLOT.unpack_from(self.map, offset)
+                if slot_digest in (digest, EMPTY) or slot_expires <= now:
+                    target = offset
+                    break
+                if target is None or slot_expires < oldest:
+                    target, oldest = offset, slot_expires
+            SLOT.pack_into(self.map, target, digest, expires_at)
+
+    def clear_tokens(self):
+        with self.locked():
+            self.map[TOKENS_OFFSET:self.size] = \
+                bytes(self.size - TOKENS_OFFSET)
+
+
+class FileLock():
+    def __init__(self, cache, exclusive):
+        self.cache = cache
+        self.operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+
+    def __enter__(self):
+        self.cache.lock.acquire()
+        try:
+            fcntl.lockf(self.cache.fd, self.operation)
+        except Exception:
+            self.cache.lock.release()
+            raise
+        return self.cache
+
+    def __exit__(self, *args):
+        fcntl.lockf(self.cache.fd, fcntl.LOCK_UN)
+        self.cache.lock.release()
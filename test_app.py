@@ -2,6 +2,11 @@ from tests.castings import *
 from tests.actors import *
 from tests.movies import *
 from tests.genders import *
+from tests.auth import *
+from tests.importer import *
+from tests.db_pool import *
+from tests.caches import *
+from tests.migrations import *
 import unittest
 
 if __name__ == "__main__":
@@ -4,8 +4,9 @@ import string
 import random
 import json
 from jose import jwt
+from sqlalchemy import event
 from urllib.request import urlopen
-from models import setup_db, Gender, Casting, Actor, Movie
+from models import setup_db, get_db, Gender, Casting, Actor, Movie
 
 
 def prepare_movies():
@@ -102,6 +103,33 @@ def generate_casting(actor_id, movie_id):
     return casting
 
 
+def has_permission(token_detail, permission):
+    if not isinstance(token_detail, dict):
+        return False
+    return permission in token_detail.get('permissions', [])
+
+
+class QueryCounter():
+    # counts the statements sent to the database inside a with block,
+    # starting from an empty session so nothing is served from it
+    def __init__(self):
+        self.engine = get_db().engine
+        self.count = 0
+        self.statements = []
+
+    def __enter__(self):
+        get_db().session.remove()
+        event.listen(self.engine, 'before_cursor_execute', self.increment)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(self.engine, 'before_cursor_execute', self.increment)
+
+    def increment(self, connection, cursor, statement, *args):
+        self.count += 1
+        self.statements.append(statement)
+
+
 def decode_jwt(token):
     AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN")
     API_AUDIENCE = os.getenv("API_AUDIENCE")
@@ -1,12 +1,15 @@
 import os
 import json
 import unittest
-from datetime import date
+from unittest.mock import patch
+from datetime import date, datetime, timedelta
+from dateutil.relativedelta import relativedelta
 from flask_sqlalchemy import SQLAlchemy
 from app import APP
-from models import setup_db, Actor
+from models import setup_db, Actor, age_from_dob, gender_names
 from test_utilities import decode_jwt, prepare_genders
 from test_utilities import prepare_actors, generate_actor
+from test_utilities import generate_gender, QueryCounter, has_permission
 
 
 class TestActors(unittest.TestCase):
@@ -69,6 +72,108 @@ class TestActors(unittest.TestCase):
                     self.assertEqual(data['success'], False)
                     self.assertNotIn('actors', data.keys())
 
+    def test_actors_query_count(self):
+        counts = []
+        for rows in [1, 5]:
+            while Actor.query.count() < rows:
+                generate_actor(generate_gender().id)
+            # gender names come from the lookup table, loaded once
+            gender_names.all()
+            with QueryCounter() as counter:
+                actors = Actor.format_query().all()
+                [actor.format() for actor in actors]
+            self.assertEqual(len(actors), rows)
+            counts.append(counter.count)
+        self.assertEqual(counts, [1, 1])
+
+    def test_get_actors_fields(self):
+        if not has_permission(self.token_detail, 'get:actors'):
+            self.skipTest('token cannot get:actors')
+        headers = {"Authorization": f"Bearer {self.token}"}
+        with QueryCounter() as counter:
+            response = self.client().get('/actors?fields=id,name',
+                                         headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        for actor in data['actors']:
+            self.assertEqual(set(actor.keys()), {'id', 'name'})
+        self.assertEqual(counter.count, 1)
+        self.assertNotIn('gender', counter.statements[0])
+        self.assertNotIn('dob', counter.statements[0])
+
+    def test_get_actor_fields(self):
+        if not has_permission(self.token_detail, 'get:actors'):
+            self.skipTest('token cannot get:actors')
+        headers = {"Authorization": f"Bearer {self.token}"}
+        response = self.client().get(
+            f'/actors/{self.seed_id}?fields=name,gender', headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['actors'],
+                         [{'name': 'Ernest Borgnine', 'gender': 'Male'}])
+        response = self.client().get(
+            f'/actors/{self.seed_id}?fields=salary', headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_actors_etag_changes_with_date(self):
+        if not has_permission(self.token_detail, 'get:actors'):
+            self.skipTest('token cannot get:actors')
+        headers = {"Authorization": f"Bearer {self.token}"}
+        response = self.client().get('/actors', headers=headers)
+        headers['If-None-Match'] = response.headers['ETag']
+        response = self.client().get('/actors', headers=headers)
+        self.assertEqual(response.status_code, 304)
+        # ages are a day older tomorrow, whether or not anything is written
+        tomorrow = date.today() + timedelta(days=1)
+        with patch('generations.reference_date', return_value=tomorrow):
+            response = self.client().get('/actors', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'],
+                            headers['If-None-Match'])
+
+    def test_cached_actors_follow_date(self):
+        if not has_permission(self.token_detail, 'get:actors'):
+            self.skipTest('token cannot get:actors')
+        headers = {"Authorization": f"Bearer {self.token}"}
+        today = date.today()
+        self.client().get('/actors', headers=headers)
+        # a year on, the cached listing holds the wrong ages
+        next_year = today + relativedelta(years=1)
+        with patch('generations.reference_date', return_value=next_year), \
+                patch('models.reference_date', return_value=next_year):
+            response = self.client().get('/actors', headers=headers)
+        actor = json.loads(response.data)['actors'][0]
+        dob = datetime.strptime(actor['dob'], '%a, %d %b %Y %H:%M:%S %Z')
+        self.assertEqual(actor['age'], age_from_dob(dob, next_year))
+
+    def test_get_actors_age_range(self):
+        if not has_permission(self.token_detail, 'get:actors'):
+            self.skipTest('token cannot get:actors')
+        today = date.today()
+        born = today - relativedelta(years=30)
+        turning = Actor(name='Turning Thirty', dob=born,
+                        gender_id=self.seed_gender)
+        waiting = Actor(name='Still Twenty Nine',
+                        dob=born + timedelta(days=1),
+                        gender_id=self.seed_gender)
+        for actor in [turning, waiting]:
+            actor.insert()
+        turning.apply()
+        self.assertEqual(age_from_dob(turning.dob, today), 30)
+        self.assertEqual(age_from_dob(waiting.dob, today), 29)
+        response = self.client().get(
+            '/actors?min_age=30&max_age=30',
+            headers={"Authorization": f"Bearer {self.token}"})
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([actor['name'] for actor in data['actors']],
+                         ['Turning Thirty'])
+        self.assertEqual(data['actors'][0]['age'], 30)
+        response = self.client().get(
+            '/actors?min_age=old',
+            headers={"Authorization": f"Bearer {self.token}"})
+        self.assertEqual(response.status_code, 400)
+
     def test_get_actor(self):
         actor = Actor.query.filter(Actor.id == self.seed_id).one_or_none()
         token = self.token
@@ -0,0 +1,296 @@
+import os
+import json
+import socket
+import time
+import tempfile
+import threading
+import unittest
+import rsa
+from pathlib import Path
+from jose import jwt
+from jose.backends.base import Key
+from jose.utils import long_to_base64
+from auth import JWKSStore, CircuitBreaker, TokenCache, select_backend
+from shared_cache import SharedCache, default_path
+
+public_key, private_key = rsa.newkeys(512)
+
+
+def write_jwks(path, kids):
+    n = long_to_base64(public_key.n).decode('ascii')
+    e = long_to_base64(public_key.e).decode('ascii')
+    keys = [{'kty': 'RSA', 'kid': kid, 'use': 'sig', 'n': n, 'e': e}
+            for kid in kids]
+    with open(path, 'w') as jwks_file:
+        json.dump({'keys': keys}, jwks_file)
+
+
+class TestJWKSStore(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        write_jwks(self.path, ['kid-1'])
+        self.url = Path(self.path).as_uri()
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_get_known_kid(self):
+        store = JWKSStore(url=self.url, ttl=600, min_refresh=0)
+        key = store.get('kid-1')
+        self.assertIsInstance(key, Key)
+
+    def test_unusable_keys_skipped(self):
+        store = JWKSStore(url=self.url)
+        keys = store.build({'keys': [
+            {'kty': 'RSA', 'kid': 'bad', 'n': '!', 'e': '!'},
+            {'kty': 'EC', 'kid': 'ec', 'crv': 'P-256', 'x': '', 'y': ''}
+        ]})
+        self.assertEqual(keys, {})
+
+    def test_keys_cached_until_ttl(self):
+        store = JWKSStore(url=self.url, ttl=600, min_refresh=600)
+        store.get('kid-1')
+        os.remove(self.path)
+        self.assertIsNotNone(store.get('kid-1'))
+        write_jwks(self.path, ['kid-1'])
+
+    def test_unknown_kid_refetches(self):
+        store = JWKSStore(url=self.url, ttl=600, min_refresh=0)
+        store.get('kid-1')
+        write_jwks(self.path, ['kid-1', 'kid-2'])
+        self.assertIsNotNone(store.get('kid-2'))
+
+    def test_unknown_kid_refetch_is_rate_limited(self):
+        store = JWKSStore(url=self.url, ttl=600, min_refresh=600)
+        store.get('kid-1')
+        write_jwks(self.path, ['kid-1', 'kid-2'])
+        self.assertIsNone(store.get('kid-2'))
+
+    def test_expired_keys_refetch(self):
+        store = JWKSStore(url=self.url, ttl=0, min_refresh=600, max_stale=0)
+        store.get('kid-1')
+        write_jwks(self.path, ['kid-2'])
+        self.assertIsNone(store.get('kid-1'))
+        self.assertIsNotNone(store.get('kid-2'))
+
+    def test_expired_keys_served_while_refreshing(self):
+        store = JWKSStore(url=self.url, ttl=0, min_refresh=600,
+                          max_stale=600)
+        store.get('kid-1')
+        os.remove(self.path)
+        self.assertIsNotNone(store.get('kid-1'))
+        self.assertEqual(store.stats()['stale_hits'], 1)
+        write_jwks(self.path, ['kid-1'])
+
+    def test_breaker_stops_fetches(self):
+        breaker = CircuitBreaker(threshold=2, cooldown=600)
+        store = JWKSStore(url=self.url + '.missing', breaker=breaker)
+        for _ in range(4):
+            self.assertIsNone(store.get('kid-1'))
+        stats = store.stats()
+        self.assertEqual(stats['failures'], 2)
+        self.assertEqual(stats['short_circuits'], 2)
+        self.assertEqual(stats['breaker'], 'open')
+        self.assertFalse(store.available())
+
+    def test_hanging_endpoint_times_out(self):
+        # the endpoint accepts the connection and never answers
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        url = f'http://127.0.0.1:{server.getsockname()[1]}/jwks.json'
+        breaker = CircuitBreaker(threshold=1, cooldown=600)
+        store = JWKSStore(url=url, breaker=breaker, timeout=0.1)
+        try:
+            self.assertIsNone(store.get('kid-1'))
+        finally:
+            server.close()
+        stats = store.stats()
+        self.assertEqual(stats['failures'], 1)
+        self.assertEqual(stats['breaker'], 'open')
+
+    def test_single_flight_refresh(self):
+        store = JWKSStore(url=self.url)
+        fetch = store.fetch
+
+        def slow_fetch():
+            time.sleep(0.2)
+            return fetch()
+        store.fetch = slow_fetch
+        threads = [threading.Thread(target=store.get, args=('kid-1',))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(store.stats()['refreshes'], 1)
+
+
+class TestTokenCache(unittest.TestCase):
+    def setUp(self):
+        self.token = jwt.encode({'sub': 'x'}, 'secret', algorithm='HS256',
+                                headers={'kid': 'kid-1'})
+        self.payload = {'sub': 'x', 'exp': time.time() + 600}
+
+    def test_hit_after_put(self):
+        cache = TokenCache()
+        self.assertIsNone(cache.get(self.token))
+        cache.put(self.token, self.payload)
+        self.assertEqual(cache.get(self.token), self.payload)
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_expired_token_not_served(self):
+        cache = TokenCache()
+        cache.put(self.token, {'sub': 'x', 'exp': time.time() - 1})
+        self.assertIsNone(cache.get(self.token))
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+    def test_token_without_exp_not_cached(self):
+        cache = TokenCache()
+        cache.put(self.token, {'sub': 'x'})
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_lru_eviction(self):
+        cache = TokenCache(max_entries=2)
+        tokens = [self.token + str(i) for i in range(3)]
+        for token in tokens:
+            cache.put(token, self.payload)
+        cache.get(tokens[1])
+        cache.put(self.token, self.payload)
+        self.assertIsNone(cache.get(tokens[2]))
+        self.assertIsNotNone(cache.get(tokens[1]))
+        self.assertEqual(cache.stats()['evictions'], 2)
+
+    def test_byte_budget(self):
+        cache = TokenCache(max_bytes=len(self.token) * 3)
+        for i in range(5):
+            cache.put(self.token + str(i), self.payload)
+        self.assertLessEqual(cache.stats()['bytes'], len(self.token) * 3)
+
+    def test_rotated_kid_is_revoked(self):
+        cache = TokenCache()
+        cache.put(self.token, self.payload)
+        cache.retain_kids({'kid-2'})
+        self.assertIsNone(cache.get(self.token))
+        self.assertEqual(cache.stats()['revocations'], 1)
+
+    def test_hit_checks_signing_key(self):
+        handle, path = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        write_jwks(path, ['kid-1'])
+        store = JWKSStore(url=Path(path).as_uri(), ttl=0, min_refresh=600,
+                          max_stale=0)
+        cache = TokenCache()
+        cache.key = store.get
+        store.listeners.append(cache.retain_kids)
+        cache.put(self.token, self.payload)
+        self.assertEqual(cache.get(self.token), self.payload)
+        # the key was removed, and the key set has gone stale since
+        write_jwks(path, ['kid-2'])
+        self.assertIsNone(cache.get(self.token))
+        os.remove(path)
+        self.assertEqual(store.stats()['refreshes'], 2)
+        self.assertEqual(cache.stats()['entries'], 0)
+
+
+class TestCryptoBackend(unittest.TestCase):
+    def test_auto_selects_a_backend(self):
+        name, key_class = select_backend('auto')
+        self.assertIn(name, ['cryptography', 'rsa'])
+        self.assertTrue(issubclass(key_class, Key))
+
+    def test_unknown_backend(self):
+        with self.assertRaises(RuntimeError):
+            select_backend('pycrypto')
+
+
+class TestSharedCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'shared.cache')
+        self.cache = SharedCache.open(self.path, slots=64)
+        self.token = jwt.encode({'sub': 'x', 'exp': time.time() + 600},
+                                'secret', algorithm='HS256',
+                                headers={'kid': 'kid-1'})
+
+    def tearDown(self):
+        os.remove(self.path)
+        os.rmdir(self.directory)
+
+    def test_jwks_visible_to_other_instances(self):
+        self.cache.put_jwks(b'{"keys": []}')
+        other = SharedCache.open(self.path, slots=64)
+        document, fetched_at = other.get_jwks()
+        self.assertEqual(document, b'{"keys": []}')
+        self.assertIsNone(other.get_jwks(newer_than=fetched_at))
+        self.assertIsNone(other.get_jwks(max_age=0))
+
+    def test_token_digests_shared_across_processes(self):
+        digest = TokenCache.digest(self.token)
+        pid = os.fork()
+        if pid == 0:
+            self.cache.put_token(digest, time.time() + 600)
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertTrue(self.cache.has_token(digest))
+        self.cache.clear_tokens()
+        self.assertFalse(self.cache.has_token(digest))
+
+    def test_expired_token_digest(self):
+        digest = TokenCache.digest(self.token)
+        self.cache.put_token(digest, time.time() - 1)
+        self.assertFalse(self.cache.has_token(digest))
+
+    def test_table_overflow_replaces_oldest(self):
+        digests = [TokenCache.digest(self.token + str(i)) for i in range(200)]
+        for digest in digests:
+            self.cache.put_token(digest, time.time() + 600)
+        self.assertTrue(self.cache.has_token(digests[-1]))
+
+    def test_disabled_without_path(self):
+        self.assertIsNone(SharedCache.open(''))
+
+    def test_disabled_for_public_file(self):
+        os.chmod(self.path, 0o644)
+        self.assertIsNone(SharedCache.open(self.path, slots=64))
+
+    def test_other_deployment_refused(self):
+        # a token verified for one audience is no proof for another
+        self.assertIsNone(SharedCache.open(self.path, slots=64,
+                                           namespace='staging'))
+        self.assertNotEqual(default_path('staging'), default_path('prod'))
+
+    def test_mapped_file_not_shrunk(self):
+        size = os.path.getsize(self.path)
+        self.assertIsNone(SharedCache.open(self.path, slots=32))
+        self.assertEqual(os.path.getsize(self.path), size)
+        self.assertTrue(self.cache.put_jwks(b'{"keys": []}'))
+
+    def test_token_verified_by_other_worker(self):
+        worker = TokenCache(shared=self.cache)
+        other = TokenCache(shared=SharedCache.open(self.path, slots=64))
+        other.retain_kids({'kid-1'})
+        worker.put(self.token, jwt.get_unverified_claims(self.token))
+        self.assertIsNotNone(other.get(self.token))
+        self.assertEqual(other.stats()['shared_hits'], 1)
+
+    def test_shared_token_with_unknown_kid_ignored(self):
+        worker = TokenCache(shared=self.cache)
+        other = TokenCache(shared=SharedCache.open(self.path, slots=64))
+        other.retain_kids({'kid-2'})
+        worker.put(self.token, jwt.get_unverified_claims(self.token))
+        self.assertIsNone(other.get(self.token))
+
+    def test_jwks_fetched_by_other_worker(self):
+        handle, jwks_path = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        write_jwks(jwks_path, ['kid-1'])
+        url = Path(jwks_path).as_uri()
+        JWKSStore(url=url, shared=self.cache).get('kid-1')
+        os.remove(jwks_path)
+        store = JWKSStore(url=url, shared=self.cache)
+        self.assertIsNotNone(store.get('kid-1'))
+        self.assertEqual(store.stats()['shared_hits'], 1)
@@ -0,0 +1,175 @@
+import time
+import unittest
+from app import APP
+from models import setup_db, get_db, Movie
+from response_cache import ResponseCache, ENTRY_OVERHEAD
+from row_cache import RowCache
+from generations import generations
+from notifications import Listener
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.context = APP.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        self.context.pop()
+
+    def response(self, body):
+        return APP.response_class(body, content_type='application/json')
+
+    def test_hit_only_with_current_tag(self):
+        cache = ResponseCache()
+        cache.put('/movies?', 'a', ['movie'], self.response('[1]'))
+        self.assertEqual(cache.get('/movies?', 'a').get_data(), b'[1]')
+        self.assertIsNone(cache.get('/movies?', 'b'))
+        self.assertIsNone(cache.get('/actors?', 'a'))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+    def test_evicts_least_recently_used(self):
+        cache = ResponseCache(max_bytes=3 * (ENTRY_OVERHEAD + 10))
+        for key in ['/a', '/b', '/c']:
+            cache.put(key, 'tag', ['movie'], self.response('0123456'))
+        cache.get('/a', 'tag')
+        cache.put('/d', 'tag', ['movie'], self.response('0123456'))
+        self.assertIsNone(cache.get('/b', 'tag'))
+        self.assertIsNotNone(cache.get('/a', 'tag'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertLessEqual(cache.stats()['bytes'], cache.max_bytes)
+
+    def test_invalidates_joined_tables(self):
+        cache = ResponseCache()
+        cache.put('/castings', 'tag', ['actor', 'casting', 'movie'],
+                  self.response('[]'))
+        cache.put('/genders', 'tag', ['gender'], self.response('[]'))
+        cache.invalidate({'movie'})
+        self.assertIsNone(cache.get('/castings', 'tag'))
+        self.assertIsNotNone(cache.get('/genders', 'tag'))
+
+    def test_entries_expire(self):
+        cache = ResponseCache(ttl=0)
+        cache.put('/actors', 'tag', ['actor'], self.response('[]'))
+        self.assertIsNone(cache.get('/actors', 'tag'))
+        self.assertEqual(cache.stats()['expirations'], 1)
+        self.assertEqual(cache.stats()['bytes'], 0)
+
+    def test_skips_large_responses(self):
+        cache = ResponseCache(max_bytes=4096, max_entry_bytes=512)
+        cache.put('/movies', 'tag', ['movie'], self.response('x' * 1024))
+        self.assertEqual(cache.stats()['entries'], 0)
+
+
+# the epoch and counters of the tables a record was read from
+GENERATION = (1, [0])
+
+
+class TestRowCache(unittest.TestCase):
+    def test_records_and_misses(self):
+        cache = RowCache(negative_ttl=0)
+        self.assertEqual(cache.get(Movie, 1, GENERATION), (False, None))
+        cache.put(Movie, 1, {'id': 1}, ['movie'], GENERATION,
+                  cache.current())
+        cache.put(Movie, 2, None, ['movie'], GENERATION, cache.current())
+        self.assertEqual(cache.get(Movie, 1, GENERATION), (True, {'id': 1}))
+        # the miss has already expired
+        self.assertEqual(cache.get(Movie, 2, GENERATION), (False, None))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'],
+                          stats['expirations']), (1, 2, 1))
+        self.assertEqual(stats['hit_ratio'], 1 / 3)
+
+    def test_negative_hits(self):
+        cache = RowCache()
+        cache.put(Movie, 2, None, ['movie'], GENERATION, cache.current())
+        self.assertEqual(cache.get(Movie, 2, GENERATION), (True, None))
+        self.assertEqual(cache.stats()['negative_hits'], 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = RowCache(max_entries=2)
+        for record_id in [1, 2]:
+            cache.put(Movie, record_id, {'id': record_id}, ['movie'],
+                      GENERATION, cache.current())
+        cache.get(Movie, 1, GENERATION)
+        cache.put(Movie, 3, {'id': 3}, ['movie'], GENERATION,
+                  cache.current())
+        self.assertFalse(cache.get(Movie, 2, GENERATION)[0])
+        self.assertTrue(cache.get(Movie, 1, GENERATION)[0])
+
+    def test_invalidation(self):
+        cache = RowCache()
+        cache.put(Movie, 1, {'id': 1}, ['movie', 'casting'], GENERATION,
+                  cache.current())
+        cache.put(Movie, 2, {'id': 2}, ['movie'], GENERATION,
+                  cache.current())
+        cache.invalidate({'casting'})
+        self.assertFalse(cache.get(Movie, 1, GENERATION)[0])
+        self.assertTrue(cache.get(Movie, 2, GENERATION)[0])
+        # a read that started before a write does not put back old data
+        version = cache.current()
+        cache.discard(Movie, 2)
+        cache.put(Movie, 2, {'id': 2}, ['movie'], GENERATION, version)
+        self.assertFalse(cache.get(Movie, 2, GENERATION)[0])
+
+    def test_other_generation(self):
+        # a write committed by another worker bumped the shared counter
+        cache = RowCache()
+        cache.put(Movie, 1, {'id': 1}, ['movie'], GENERATION,
+                  cache.current())
+        self.assertEqual(cache.get(Movie, 1, (1, [1])), (False, None))
+        self.assertFalse(cache.get(Movie, 1, GENERATION)[0])
+        self.assertEqual(cache.stats()['stale'], 1)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class TestListener(unittest.TestCase):
+    def setUp(self):
+        setup_db(APP, test_mode=True)
+        with APP.app_context():
+            self.url = get_db().engine.url
+        self.listener = Listener(max_staleness=0.05)
+
+    def tearDown(self):
+        self.listener.stop()
+
+    def test_writes_from_other_connections(self):
+        self.listener.start(self.url, ['gender'])
+        self.assertTrue(wait_for(lambda: self.listener.listening))
+        before = generations.stats(['gender'])['gender']
+        with APP.app_context():
+            # as another host would, so only the trigger knows of it
+            with get_db().engine.begin() as connection:
+                connection.execute("SET LOCAL application_name = 'other'")
+                connection.execute("UPDATE gender SET name = name")
+        self.assertTrue(wait_for(
+            lambda: self.listener.stats()['notifications'] > 0))
+        self.assertGreater(generations.stats(['gender'])['gender'], before)
+
+    def test_writes_from_this_host(self):
+        self.listener.start(self.url, ['gender'])
+        self.assertTrue(wait_for(lambda: self.listener.listening))
+        before = generations.stats(['gender'])['gender']
+        with APP.app_context():
+            # connections of the app carry the origin of the counters, which
+            # the committing process bumps itself
+            with get_db().engine.begin() as connection:
+                connection.execute("UPDATE gender SET name = name")
+        self.assertTrue(wait_for(
+            lambda: self.listener.stats()['notifications'] > 0))
+        self.assertEqual(generations.stats(['gender'])['gender'], before)
+
+    def test_bounded_staleness_without_database(self):
+        self.listener.start('postgresql://nobody@/none?host=/nonexistent',
+                            ['gender'])
+        before = generations.stats(['gender'])['gender']
+        self.assertTrue(wait_for(
+            lambda: self.listener.stats()['stale_invalidations'] > 1))
+        self.assertFalse(self.listener.stats()['listening'])
+        self.assertGreater(generations.stats(['gender'])['gender'], before)
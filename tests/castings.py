@@ -9,6 +9,9 @@ from models import setup_db, Casting
 from test_utilities import decode_jwt, prepare_genders
 from test_utilities import prepare_actors, prepare_movies
 from test_utilities import prepare_castings, generate_casting
+from test_utilities import generate_actor, generate_movie, QueryCounter
+from test_utilities import has_permission
+from unit_of_work import checkout_stats
 
 
 class TestCastings(unittest.TestCase):
@@ -74,6 +77,130 @@ class TestCastings(unittest.TestCase):
                     self.assertEqual(data['success'], False)
                     self.assertNotIn('castings', data.keys())
 
+    def test_castings_query_count(self):
+        counts = []
+        for rows in [1, 5]:
+            while Casting.query.count() < rows:
+                actor = generate_actor(self.seed_gender)
+                movie = generate_movie()
+                generate_casting(actor.id, movie.id)
+            with QueryCounter() as counter:
+                castings = Casting.format_query().all()
+                [casting.format() for casting in castings]
+            self.assertEqual(len(castings), rows)
+            counts.append(counter.count)
+        self.assertEqual(counts, [1, 1])
+
+    def test_get_castings_filtered(self):
+        if not has_permission(self.token_detail, 'get:castings'):
+            self.skipTest('token cannot get:castings')
+        other_movie = generate_movie()
+        generate_casting(self.seed_actor, other_movie.id)
+        headers = {"Authorization": f"Bearer {self.token}"}
+        response = self.client().get(
+            f'/castings?movie_id={other_movie.id}&fields=movie',
+            headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['castings'], [{'movie': other_movie.title}])
+        tomorrow = (datetime.now() + timedelta(days=1)).isoformat()
+        response = self.client().get(f'/castings?from={tomorrow}',
+                                     headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(data['castings'], [])
+        response = self.client().get('/castings?to=yesterday',
+                                     headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_casting_writes_query_count(self):
+        for permission in ['post:castings', 'patch:castings',
+                           'delete:castings']:
+            if not has_permission(self.token_detail, permission):
+                self.skipTest(f'token cannot {permission}')
+        headers = {"Authorization": f"Bearer {self.token}"}
+        casting = {"actor_id": self.seed_actor,
+                   "movie_id": self.seed_movie,
+                   "casting_date": "2021-02-01T00:00:00"}
+        with QueryCounter() as counter:
+            response = self.client().post('/castings', json=casting,
+                                          headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(data['castings'][0]['movie'],
+                         'The Girl with the Dragon Tattoo')
+        casting_id = data['created']
+        casting['recast_yn'] = 1
+        with QueryCounter() as counter:
+            response = self.client().patch(f'/castings/{casting_id}',
+                                           json=casting, headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(data['castings'][0]['recast_yn'], 'Y')
+        with QueryCounter() as counter:
+            response = self.client().delete(f'/castings/{casting_id}',
+                                            headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(counter.count, 1)
+
+    def test_one_checkout_per_request(self):
+        for permission in ['get:castings', 'post:castings',
+                           'patch:castings', 'delete:castings']:
+            if not has_permission(self.token_detail, permission):
+                self.skipTest(f'token cannot {permission}')
+        headers = {"Authorization": f"Bearer {self.token}"}
+        casting = {"actor_id": self.seed_actor,
+                   "movie_id": self.seed_movie,
+                   "casting_date": "2021-03-01T00:00:00"}
+        before = checkout_stats.stats()
+        response = self.client().post('/castings', json=casting,
+                                      headers=headers)
+        casting_id = json.loads(response.data)['created']
+        self.client().get('/castings', headers=headers)
+        # a patch changing nothing runs an update and a select
+        self.client().patch(f'/castings/{casting_id}', json=casting,
+                            headers=headers)
+        self.client().delete(f'/castings/{casting_id}', headers=headers)
+        after = checkout_stats.stats()
+        self.assertEqual(after['requests'] - before['requests'], 4)
+        self.assertEqual(after['checkouts'] - before['checkouts'], 4)
+        self.assertEqual(after['requests_with_extra_checkouts'],
+                         before['requests_with_extra_checkouts'])
+
+    def test_create_castings_batch(self):
+        if not has_permission(self.token_detail, 'post:castings'):
+            self.skipTest('token cannot post:castings')
+        casting_dates = [(datetime(2021, 1, 1) + timedelta(days=day))
+                         .isoformat() for day in range(3)]
+        castings = [{"actor_id": self.seed_actor,
+                     "movie_id": self.seed_movie,
+                     "casting_date": casting_date}
+                    for casting_date in casting_dates]
+        castings.append(dict(castings[0]))
+        castings.append({"actor_id": self.seed_actor + 1000,
+                         "movie_id": self.seed_movie,
+                         "casting_date": casting_dates[0]})
+        castings.append({"actor_id": self.seed_actor})
+        headers = {"Authorization": f"Bearer {self.token}"}
+        with QueryCounter() as counter:
+            response = self.client().post('/castings/batch', json=castings,
+                                          headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len([i for i in data['created'] if i]), 3)
+        self.assertEqual(data['created'][3:], [None, None, None])
+        self.assertEqual([error['index'] for error in data['errors']],
+                         [3, 4, 5])
+        self.assertEqual(data['errors'][1]['message'], 'unknown actor_id')
+        # two foreign key checks, one unique key check and one insert
+        self.assertEqual(counter.count, 4)
+        response = self.client().post('/castings/batch', json=castings[:1],
+                                      headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(data['created'], [None])
+        response = self.client().post('/castings/batch', json={},
+                                      headers=headers)
+        self.assertEqual(response.status_code, 400)
+
     def test_get_casting(self):
         casting = Casting.query.filter(
             Casting.id == self.seed_id).one_or_none()
@@ -193,6 +320,53 @@ class TestCastings(unittest.TestCase):
                     self.assertNotIn('castings', data.keys())
                     self.assertEqual(data['success'], False)
 
+    def test_patch_casting_partial(self):
+        if not has_permission(self.token_detail, 'patch:castings'):
+            self.skipTest('token cannot patch:castings')
+        casting = generate_casting(self.seed_actor, self.seed_movie)
+        casting_id, casting_date = casting.id, casting.casting_date
+        casting.dispose()
+        headers = {"Authorization": f"Bearer {self.token}"}
+        response = self.client().patch(f'/castings/{casting_id}',
+                                       json={'recast_yn': 1},
+                                       headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['castings'][0]['recast_yn'], 'Y')
+        casting = Casting.query.filter(Casting.id == casting_id).one()
+        self.assertEqual(casting.casting_date, casting_date)
+        casting.dispose()
+        # a patch changing nothing does not write a new row version
+        version = "SELECT xmin::text FROM casting WHERE id = :id"
+        before = self.db.session.execute(version, {'id': casting_id})
+        before = before.scalar()
+        response = self.client().patch(f'/castings/{casting_id}',
+                                       json={'recast_yn': 1},
+                                       headers=headers)
+        self.assertEqual(response.status_code, 200)
+        after = self.db.session.execute(version, {'id': casting_id})
+        self.assertEqual(after.scalar(), before)
+        response = self.client().patch(f'/castings/{casting_id}',
+                                       json={}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_casting_etag_follows_movies(self):
+        for permission in ['get:castings', 'patch:movies']:
+            if not has_permission(self.token_detail, permission):
+                self.skipTest(f'token cannot {permission}')
+        headers = {"Authorization": f"Bearer {self.token}"}
+        response = self.client().get('/castings', headers=headers)
+        headers['If-None-Match'] = response.headers['ETag']
+        response = self.client().get('/castings', headers=headers)
+        self.assertEqual(response.status_code, 304)
+        # renaming the movie changes the castings listing, cached or not
+        self.client().patch(f'/movies/{self.seed_movie}',
+                            json={'title': 'Renamed'}, headers=headers)
+        response = self.client().get('/castings', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        castings = json.loads(response.data)['castings']
+        self.assertEqual(castings[0]['movie'], 'Renamed')
+
     def test_delete_casting(self):
         token = self.token
         casting = generate_casting(self.seed_actor, self.seed_movie)
@@ -0,0 +1,80 @@
+import os
+import json
+import sqlite3
+import unittest
+from sqlalchemy import exc
+from app import APP
+from db_pool import pool_sizes, WaitStats, TimedQueuePool
+from test_utilities import decode_jwt, has_permission
+
+
+class TestPoolSizes(unittest.TestCase):
+    def test_connection_per_thread(self):
+        self.assertEqual(pool_sizes(workers=4, threads=8,
+                                    max_connections=0), (8, 4))
+
+    def test_capped_by_max_connections(self):
+        size, overflow = pool_sizes(workers=9, threads=8,
+                                    max_connections=90, reserved=0)
+        self.assertEqual((size, overflow), (8, 2))
+        size, overflow = pool_sizes(workers=9, threads=8,
+                                    max_connections=45, reserved=0)
+        self.assertEqual((size, overflow), (5, 0))
+
+    def test_listener_connection_reserved(self):
+        size, overflow = pool_sizes(workers=9, threads=8,
+                                    max_connections=90, reserved=1)
+        self.assertEqual((size, overflow), (8, 1))
+        size, overflow = pool_sizes(workers=9, threads=8,
+                                    max_connections=45, reserved=1)
+        self.assertEqual((size, overflow), (4, 0))
+
+    def test_at_least_one_connection(self):
+        self.assertEqual(pool_sizes(workers=9, threads=8,
+                                    max_connections=4), (1, 0))
+
+
+class TestTimedQueuePool(unittest.TestCase):
+    def test_wait_histogram(self):
+        waits = WaitStats(buckets=(0.01, 0.1))
+        for seconds in [0.001, 0.05, 0.05, 3]:
+            waits.record(seconds)
+        stats = waits.stats()
+        self.assertEqual([bucket['count'] for bucket in stats['histogram']],
+                         [1, 3, 4])
+        self.assertEqual(stats['count'], 4)
+
+    def test_checkout_and_timeout(self):
+        pool = TimedQueuePool(lambda: sqlite3.connect(':memory:'),
+                              pool_size=1, max_overflow=0, timeout=0.05)
+        connection = pool.connect()
+        stats = pool.stats()
+        self.assertEqual(stats['checked_out'], 1)
+        with self.assertRaises(exc.TimeoutError):
+            pool.connect()
+        connection.close()
+        stats = pool.stats()
+        self.assertEqual(stats['checked_out'], 0)
+        self.assertEqual(stats['waits']['count'], 2)
+        self.assertEqual(stats['waits']['timeouts'], 1)
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.client = APP.test_client
+        self.token = os.getenv('TOKEN') if len(
+            os.getenv('TOKEN')) > 0 else None
+        self.token_detail = decode_jwt(self.token)
+
+    def test_get_metrics(self):
+        response = self.client().get(
+            '/metrics', headers={"Authorization": f"Bearer {self.token}"})
+        data = json.loads(response.data)
+        if not has_permission(self.token_detail, 'get:metrics'):
+            self.assertEqual(response.status_code, 401)
+            self.assertNotIn('pool', data.keys())
+        else:
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('checked_out', data['pool'])
+            self.assertIn('histogram', data['pool']['waits'])
+            self.assertLessEqual(data['requests']['max_checkouts'], 1)
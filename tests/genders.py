@@ -2,10 +2,11 @@ import os
 import unittest
 import json
 from app import APP
-from models import setup_db, Gender
+from models import setup_db, Gender, gender_names
+from generations import generations
 from flask_sqlalchemy import SQLAlchemy
 from test_utilities import decode_jwt, generate_gender
-from test_utilities import prepare_genders
+from test_utilities import prepare_genders, has_permission, QueryCounter
 
 
 class TestGenders(unittest.TestCase):
@@ -64,6 +65,52 @@ class TestGenders(unittest.TestCase):
                     self.assertNotIn('genders', data.keys())
                     self.assertEqual(data['success'], False)
 
+    def test_genders_lookup_table(self):
+        for permission in ['get:genders', 'post:genders']:
+            if not has_permission(self.token_detail, permission):
+                self.skipTest(f'token cannot {permission}')
+        headers = {"Authorization": f"Bearer {self.token}"}
+        self.client().get('/genders', headers=headers)
+        # served from memory, in the database's order of ids
+        with QueryCounter() as counter:
+            response = self.client().get('/genders?sort=-id&limit=1',
+                                         headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(counter.count, 0)
+        self.assertEqual([gender['id'] for gender in data['genders']],
+                         [self.seed_id])
+        self.assertIsNone(data['next'])
+        # and refreshed by writes
+        response = self.client().post('/genders', json=self.post_gender,
+                                      headers=headers)
+        created = json.loads(response.data)['created']
+        response = self.client().get('/genders?sort=-id&limit=1',
+                                     headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(data['genders'], [{'id': created,
+                                            'name': 'Female'}])
+        response = self.client().get(f'/genders?sort=-id&limit=1&cursor='
+                                     f'{data["next"]}&fields=name',
+                                     headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(len(data['genders']), 1)
+        self.assertEqual(list(data['genders'][0]), ['name'])
+
+    def test_lookup_table_follows_generation(self):
+        with self.app.test_request_context():
+            self.assertEqual(gender_names.get(self.seed_id)['name'], 'Male')
+            loads = gender_names.stats()['loads']
+        with self.app.test_request_context():
+            gender_names.all()
+            self.assertEqual(gender_names.stats()['loads'], loads)
+        # another worker wrote the table and bumped the shared counter,
+        # without this process hearing of it
+        generations.bump(['gender'])
+        with self.app.test_request_context():
+            gender_names.all()
+            gender_names.all()
+            self.assertEqual(gender_names.stats()['loads'], loads + 1)
+
     def test_get_gender(self):
         gender = Gender.query.filter(Gender.id == self.seed_id).one_or_none()
         token = self.token
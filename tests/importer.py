@@ -0,0 +1,94 @@
+import io
+import os
+import tempfile
+import unittest
+from flask import Flask
+from models import setup_db, get_db, Movie, Gender, Actor, Casting
+from app import APP
+from importer import import_csv
+from test_utilities import prepare_genders, prepare_actors, prepare_movies
+
+MOVIES = '''title,release_date
+Alien,1979-05-25
+Aliens,1986-07-18
+Alien,1992-05-22
+Alien 3,someday
+'''
+
+ACTORS = '''name,dob,gender
+Sigourney Weaver,1949-10-08,Female
+Tom Skerritt,1933-08-25,Male
+Nobody,1950-01-01,Other
+Missing,1950-01-01,
+'''
+
+
+class TestImporterSQLite(unittest.TestCase):
+    # the executemany path, against a throwaway sqlite database
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{self.path}'
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        get_db().init_app(self.app)
+        with self.app.app_context():
+            get_db().create_all()
+            get_db().session.add_all([Gender(name='Female'),
+                                      Gender(name='Male')])
+            get_db().session.commit()
+
+    def tearDown(self):
+        with self.app.app_context():
+            get_db().session.remove()
+            get_db().engine.dispose()
+        os.remove(self.path)
+
+    def test_import_movies(self):
+        with self.app.app_context():
+            stats = import_csv(Movie, io.StringIO(MOVIES), batch_size=2)
+            self.assertEqual(stats['rows'], 4)
+            self.assertEqual(stats['imported'], 2)
+            self.assertEqual(stats['errors'], [
+                {'line': 4, 'message': 'title already exists'},
+                {'line': 5, 'message': 'invalid release_date'}])
+            self.assertEqual(Movie.query.count(), 2)
+
+    def test_import_resolves_gender_names(self):
+        with self.app.app_context():
+            stats = import_csv(Actor, io.StringIO(ACTORS))
+            self.assertEqual(stats['imported'], 2)
+            self.assertEqual([error['message'] for error in stats['errors']],
+                             ['unknown gender', 'missing gender'])
+            actor = Actor.query.filter(Actor.name == 'Tom Skerritt').one()
+            self.assertEqual(actor.gender.name, 'Male')
+            self.assertGreater(stats['rows_per_second'], 0)
+
+
+class TestImporter(unittest.TestCase):
+    # the copy path, against the test database
+    def setUp(self):
+        self.app = APP
+        setup_db(self.app, test_mode=True)
+        self.seed_movie = prepare_movies()
+        self.seed_gender = prepare_genders()
+        self.seed_actor = prepare_actors(self.seed_gender)
+
+    def test_import_castings(self):
+        castings = '\n'.join([
+            'actor_id,movie,casting_date,recast_yn',
+            f'{self.seed_actor},The Girl with the Dragon Tattoo,2021-01-01,',
+            f'{self.seed_actor},The Girl with the Dragon Tattoo,2021-01-02,y',
+            f'{self.seed_actor},The Girl with the Dragon Tattoo,2021-01-02,n',
+            f'{self.seed_actor + 1000},The Girl with the Dragon Tattoo,'
+            '2021-01-03,n',
+            f'{self.seed_actor},Unknown Title,2021-01-04,n'
+        ])
+        with self.app.app_context():
+            stats = import_csv(Casting, io.StringIO(castings), batch_size=2)
+            self.assertEqual(stats['imported'], 2)
+            self.assertEqual([error['message'] for error in stats['errors']],
+                             ['actor_id, movie_id, casting_date already '
+                              'exists', 'unknown actor_id', 'unknown movie'])
+            recast = Casting.query.filter(Casting.recast_yn).one()
+            self.assertEqual(recast.movie_id, self.seed_movie)
@@ -0,0 +1,38 @@
+import unittest
+from app import APP
+from models import setup_db, get_db
+
+
+class TestWriteNotifications(unittest.TestCase):
+    # the triggers of the write notifications migration
+    def setUp(self):
+        setup_db(APP, test_mode=True)
+
+    def test_truncate(self):
+        with APP.app_context():
+            with get_db().engine.connect() as connection:
+                transaction = connection.begin()
+                try:
+                    connection.execute('TRUNCATE casting, actor, movie, '
+                                       'gender')
+                    for table in ['casting', 'actor', 'movie', 'gender']:
+                        self.assertEqual(connection.execute(
+                            f'SELECT count(*) FROM {table}').scalar(), 0)
+                finally:
+                    transaction.rollback()
+
+    def test_notification_payload(self):
+        with APP.app_context():
+            with get_db().engine.connect() as connection:
+                dbapi_connection = connection.connection.connection
+                connection.execute('LISTEN casting_api_writes')
+                connection.execute('COMMIT')
+                with get_db().engine.begin() as writer:
+                    writer.execute("SET LOCAL application_name = 'other'")
+                    writer.execute('UPDATE movie SET title = title')
+                connection.execute('SELECT 1')
+                dbapi_connection.poll()
+                payloads = [notify.payload
+                            for notify in dbapi_connection.notifies]
+                connection.execute('UNLISTEN casting_api_writes')
+        self.assertIn('other:movie', payloads)
@@ -4,8 +4,17 @@ import unittest
 from models import setup_db, Movie
 from app import APP
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
 from test_utilities import decode_jwt, generate_movie
-from test_utilities import prepare_movies
+from test_utilities import prepare_movies, has_permission, QueryCounter
+from response_cache import response_cache
+from auth import token_cache
+from generations import generations
+
+
+def token_lookups():
+    stats = token_cache.stats()
+    return stats['hits'] + stats['shared_hits'] + stats['misses']
 
 
 class TestMovies(unittest.TestCase):
@@ -67,6 +76,186 @@ class TestMovies(unittest.TestCase):
                     self.assertEqual(data['success'], False)
                     self.assertNotIn('movies', data.keys())
 
+    def test_get_movies_pages(self):
+        if not has_permission(self.token_detail, 'get:movies'):
+            self.skipTest('token cannot get:movies')
+        expected = [self.seed_id] + [generate_movie().id for _ in range(4)]
+        headers = {"Authorization": f"Bearer {self.token}"}
+        seen = []
+        url = '/movies?limit=2'
+        while url is not None:
+            response = self.client().get(url, headers=headers)
+            data = json.loads(response.data)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(data['movies']), 2)
+            seen += [movie['id'] for movie in data['movies']]
+            url = None
+            if data['next'] is not None:
+                url = f'/movies?limit=2&cursor={data["next"]}'
+        self.assertEqual(seen, sorted(expected))
+
+    def test_get_movies_sorted_pages(self):
+        if not has_permission(self.token_detail, 'get:movies'):
+            self.skipTest('token cannot get:movies')
+        for _ in range(4):
+            generate_movie()
+        headers = {"Authorization": f"Bearer {self.token}"}
+        titles = []
+        url = '/movies?limit=2&sort=-title'
+        while url is not None:
+            response = self.client().get(url, headers=headers)
+            data = json.loads(response.data)
+            self.assertEqual(response.status_code, 200)
+            titles += [movie['title'] for movie in data['movies']]
+            url = None
+            if data['next'] is not None:
+                url = f'/movies?limit=2&sort=-title&cursor={data["next"]}'
+        self.assertEqual(titles, sorted(titles, reverse=True))
+        self.assertEqual(len(titles), Movie.query.count())
+        response = self.client().get('/movies?sort=budget', headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_movies_bad_page(self):
+        if not has_permission(self.token_detail, 'get:movies'):
+            self.skipTest('token cannot get:movies')
+        headers = {"Authorization": f"Bearer {self.token}"}
+        for query in ['limit=0', 'limit=x', 'cursor=%%%', 'cursor=e30']:
+            response = self.client().get(f'/movies?{query}', headers=headers)
+            self.assertEqual(response.status_code, 400)
+
+    def test_export_movies(self):
+        if not has_permission(self.token_detail, 'get:movies'):
+            self.skipTest('token cannot get:movies')
+        for _ in range(3):
+            generate_movie()
+        response = self.client().get(
+            '/movies/export',
+            headers={"Authorization": f"Bearer {self.token}"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data(as_text=True).splitlines()
+        movies = [json.loads(line) for line in lines]
+        self.assertEqual(len(movies), Movie.query.count())
+        self.assertEqual([movie['id'] for movie in movies],
+                         sorted(movie['id'] for movie in movies))
+
+    def test_sync_movies(self):
+        for permission in ['post:movies', 'patch:movies']:
+            if not has_permission(self.token_detail, permission):
+                self.skipTest(f'token cannot {permission}')
+        seed = Movie.query.filter(Movie.id == self.seed_id).one()
+        movies = [
+            {"title": seed.title, "release_date": "2011-12-21T00:00:00"},
+            {"title": "Blade Runner", "release_date": "1982-06-25T00:00:00"},
+            {"title": "Blade Runner", "release_date": "1982-06-26T00:00:00"},
+            {"title": "Dune"}
+        ]
+        headers = {"Authorization": f"Bearer {self.token}"}
+        lookups = token_lookups()
+        with QueryCounter() as counter:
+            response = self.client().put('/movies/sync', json=movies,
+                                         headers=headers)
+        # both permissions are checked against a single token lookup
+        self.assertEqual(token_lookups(), lookups + 1)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((data['created'], data['updated'],
+                          data['unchanged']), (1, 1, 0))
+        self.assertEqual([error['index'] for error in data['errors']],
+                         [2, 3])
+        self.assertEqual(counter.count, 1)
+        response = self.client().put('/movies/sync', json=movies[:2],
+                                     headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual((data['created'], data['updated'],
+                          data['unchanged']), (0, 0, 2))
+        self.assertEqual(Movie.query.count(), 2)
+
+    def test_conditional_get_movies(self):
+        if not has_permission(self.token_detail, 'get:movies'):
+            self.skipTest('token cannot get:movies')
+        headers = {"Authorization": f"Bearer {self.token}"}
+        response = self.client().get('/movies', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        headers['If-None-Match'] = etag
+        with QueryCounter() as counter:
+            response = self.client().get('/movies', headers=headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(counter.count, 0)
+        # another url is another representation
+        response = self.client().get('/movies?limit=1', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        if not has_permission(self.token_detail, 'patch:movies'):
+            return
+        response = self.client().patch(f'/movies/{self.seed_id}',
+                                       json={'title': 'Changed'},
+                                       headers=headers)
+        self.assertEqual(response.status_code, 200)
+        response = self.client().get('/movies', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_cached_get_movies(self):
+        if not has_permission(self.token_detail, 'get:movies'):
+            self.skipTest('token cannot get:movies')
+        headers = {"Authorization": f"Bearer {self.token}"}
+        first = self.client().get('/movies', headers=headers)
+        hits = response_cache.stats()['hits']
+        with QueryCounter() as counter:
+            second = self.client().get('/movies', headers=headers)
+        self.assertEqual(counter.count, 0)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(response_cache.stats()['hits'], hits + 1)
+        if not has_permission(self.token_detail, 'post:movies'):
+            return
+        self.client().post('/movies', json=self.post_movie, headers=headers)
+        response = self.client().get('/movies', headers=headers)
+        titles = [movie['title'] for movie in
+                  json.loads(response.data)['movies']]
+        self.assertIn(self.post_movie['title'], titles)
+
+    def test_cached_get_movie(self):
+        for permission in ['get:movies', 'patch:movies']:
+            if not has_permission(self.token_detail, permission):
+                self.skipTest(f'token cannot {permission}')
+        headers = {"Authorization": f"Bearer {self.token}"}
+        self.client().get(f'/movies/{self.seed_id}', headers=headers)
+        self.client().get('/movies/999999999', headers=headers)
+        with QueryCounter() as counter:
+            response = self.client().get(
+                f'/movies/{self.seed_id}?fields=title', headers=headers)
+            missing = self.client().get('/movies/999999999', headers=headers)
+        self.assertEqual(counter.count, 0)
+        self.assertEqual(json.loads(response.data)['movies'][0],
+                         {'title': 'The Girl with the Dragon Tattoo'})
+        self.assertEqual(missing.status_code, 404)
+        self.client().patch(f'/movies/{self.seed_id}',
+                            json={'title': 'Changed'}, headers=headers)
+        response = self.client().get(
+            f'/movies/{self.seed_id}?fields=title', headers=headers)
+        self.assertEqual(json.loads(response.data)['movies'][0],
+                         {'title': 'Changed'})
+
+    def test_cached_movie_follows_generation(self):
+        if not has_permission(self.token_detail, 'get:movies'):
+            self.skipTest('token cannot get:movies')
+        headers = {"Authorization": f"Bearer {self.token}"}
+        self.client().get(f'/movies/{self.seed_id}', headers=headers)
+        # another worker writes the movie and bumps the shared counter,
+        # without this one hearing of it
+        with self.app.app_context():
+            with self.db.engine.begin() as connection:
+                connection.execute(
+                    text('UPDATE movie SET title = :title WHERE id = :id'),
+                    {'title': 'Changed', 'id': self.seed_id})
+        generations.bump(['movie'])
+        response = self.client().get(
+            f'/movies/{self.seed_id}?fields=title', headers=headers)
+        self.assertEqual(json.loads(response.data)['movies'][0],
+                         {'title': 'Changed'})
+
     def test_get_movie(self):
         movie = Movie.query.filter(Movie.id == self.seed_id).one_or_none()
         token = self.token
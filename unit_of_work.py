@@ -0,0 +1,90 @@
+import logging
+import threading
+from functools import wraps
+from flask import abort, g, request, has_app_context
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import Pool
+from models import get_db
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+logger = logging.getLogger(__name__)
+
+
+class CheckoutStats():
+    # how many pool connections each request checked out. a request that
+    # keeps to its unit of work checks out at most one
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.checkouts = 0
+        self.max_checkouts = 0
+        self.extra_checkouts = 0
+
+    def record(self, checkouts):
+        with self.lock:
+            self.requests += 1
+            self.checkouts += checkouts
+            self.max_checkouts = max(self.max_checkouts, checkouts)
+            if checkouts > 1:
+                self.extra_checkouts += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'checkouts': self.checkouts,
+                'max_checkouts': self.max_checkouts,
+                'requests_with_extra_checkouts': self.extra_checkouts
+            }
+
+
+checkout_stats = CheckoutStats()
+
+
+@event.listens_for(Pool, 'checkout')
+def count_checkout(dbapi_connection, connection_record, connection_proxy):
+    if has_app_context() and 'checkouts' in g:
+        g.checkouts += 1
+
+
+def transactional(f):
+    # commits the request's transaction once the view has returned, so a
+    # failing commit is reported like any other failed write. reads have
+    # nothing to commit, their transaction ends with the session
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        response = f(*args, **kwargs)
+        if request.method in READ_METHODS:
+            return response
+        try:
+            get_db().session.commit()
+        except SQLAlchemyError:
+            get_db().session.rollback()
+            abort(422)
+        return response
+
+    return wrapper
+
+
+def init_app(app):
+    # one session, one transaction and one commit per request. views write
+    # through the session without committing, the transaction is committed
+    # when the view returns and rolled back if it raised or only read, and
+    # the session and its connection are released when the request is torn
+    # down
+    for endpoint, view in app.view_functions.items():
+        app.view_functions[endpoint] = transactional(view)
+
+    @app.before_request
+    def start_unit_of_work():
+        g.checkouts = 0
+
+    @app.teardown_request
+    def end_unit_of_work(exception):
+        get_db().session.remove()
+        checkouts = g.pop('checkouts', 0)
+        checkout_stats.record(checkouts)
+        if checkouts > 1:
+            logger.warning('request checked out %d connections', checkouts)
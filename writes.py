@@ -0,0 +1,87 @@
+from flask import abort
+from sqlalchemy import select, insert, update, delete, or_
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql.visitors import replacement_traverse
+from listing import format_row, detail
+from generations import written
+from row_cache import row_cache
+from models import get_db
+
+
+def adapt(table, written, expression):
+    # points the columns of table in expression at the rows written
+    def replace(element):
+        if getattr(element, 'table', None) is table:
+            return written.c[element.key]
+        return None
+    return replacement_traverse(expression, {}, replace)
+
+
+def returning(model, statement):
+    # wraps an INSERT or UPDATE in a cte returning the rows it wrote and
+    # selects the formatted fields from them, joined to the tables those
+    # fields come from, so the write and the read are a single statement
+    table = model.__table__
+    written = statement.returning(*table.c).cte('written')
+    fields = model.fields()
+    columns = [adapt(table, written, field.column).label(name)
+               for name, field in fields.items()]
+    query = select(*columns).select_from(written)
+    joins = {}
+    for field in fields.values():
+        joins.update(field.joins)
+    for target, onclause in joins.items():
+        query = query.join(target, adapt(table, written, onclause))
+    return query, fields
+
+
+def execute(statement):
+    # runs a write in the request's transaction and returns its first row
+    try:
+        return get_db().session.execute(statement).first()
+    except SQLAlchemyError:
+        abort(422)
+
+
+def insert_record(model, values):
+    query, fields = returning(model, insert(model.__table__).values(values))
+    row = execute(query)
+    written(model)
+    return format_row(fields, list(fields), row)
+
+
+def supplied(body, names):
+    # the values a patch sets, fields left out or null are left as they are
+    return {name: body[name] for name in names
+            if body.get(name, None) is not None}
+
+
+def update_record(model, record_id, values):
+    # writes only the given columns, and only when one of them differs from
+    # the stored value, without reading the record first. the formatted
+    # record, or None when there is no record with that id
+    table = model.__table__
+    changed = or_(*[table.c[name].is_distinct_from(value)
+                    for name, value in values.items()])
+    statement = update(table).where(table.c.id == record_id, changed)
+    query, fields = returning(model, statement.values(values))
+    row = execute(query)
+    if row is None:
+        # nothing was written: either there is no such record or it
+        # already holds these values
+        return detail(model, record_id)
+    written(model)
+    row_cache.discard(model, record_id)
+    return format_row(fields, list(fields), row)
+
+
+def delete_record(model, record_id):
+    # the id of the deleted record, or None when there is no record with it
+    table = model.__table__
+    statement = delete(table).where(table.c.id == record_id)
+    row = execute(statement.returning(table.c.id))
+    if row is None:
+        return None
+    written(model)
+    row_cache.discard(model, record_id)
+    return row.id